@@ -0,0 +1,57 @@
+import json
+import sqlite3
+
+class AttendanceStore:
+    """Durable attendance log (SQLite in WAL mode) with an in-memory dedup set and an outbox of unsent events."""
+
+    def __init__(self, path="attendance.db", batch_size=50, require_ack=False):
+        self.path = path
+        self.batch_size = batch_size # Outbox messages sent per websocket message when draining
+        self.require_ack = require_ack # Keep sent messages until the server acknowledges their eventId
+        self.db_conn = sqlite3.connect(path)
+        self.db_conn.execute("PRAGMA journal_mode=WAL") # Appends to a log; a power cut can never tear earlier records
+        self.db_conn.execute("PRAGMA synchronous=NORMAL") # fsync at checkpoints instead of on every mark
+        self.db_conn.execute("CREATE TABLE IF NOT EXISTS attendance (student_id TEXT NOT NULL, day TEXT NOT NULL, timestamp TEXT NOT NULL, PRIMARY KEY (student_id, day))")
+        self.db_conn.execute("CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, message TEXT NOT NULL)")
+        self.db_conn.commit()
+        self._day = None
+        self._marked = set() # Student IDs already marked on self._day
+        self.in_flight = set() # Outbox IDs sent but not yet acknowledged by the server
+
+    def _load_day(self, day):
+        if day != self._day:
+            self._day = day
+            self._marked = {row[0] for row in self.db_conn.execute("SELECT student_id FROM attendance WHERE day = ?", (day,))}
+
+    def is_marked(self, student_id, timestamp):
+        """True if the student already has attendance for the day of the timestamp."""
+        self._load_day(timestamp.date().isoformat())
+        return student_id in self._marked
+
+    def mark(self, student_ids, timestamp, messages=()):
+        """Records attendance for the given students and queues messages for the server in one transaction."""
+        self._load_day(timestamp.date().isoformat())
+        new_ids = [student_id for student_id in dict.fromkeys(student_ids) if student_id not in self._marked]
+        with self.db_conn:
+            self.db_conn.executemany("INSERT OR IGNORE INTO attendance (student_id, day, timestamp) VALUES (?, ?, ?)",
+                                     [(student_id, self._day, timestamp.isoformat()) for student_id in new_ids])
+            self.db_conn.executemany("INSERT INTO outbox (message) VALUES (?)", [(json.dumps(message),) for message in messages])
+        self._marked.update(new_ids)
+        return new_ids
+
+    def pending(self, limit=50):
+        """Returns up to limit unsent (outbox ID, message) pairs in the order they were queued."""
+        rows = self.db_conn.execute("SELECT id, message FROM outbox ORDER BY id LIMIT ?", (limit + len(self.in_flight),)).fetchall()
+        return [(outbox_id, json.loads(message)) for outbox_id, message in rows if outbox_id not in self.in_flight][:limit]
+
+    def pending_count(self):
+        return self.db_conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def ack(self, outbox_ids):
+        """Removes delivered messages from the outbox."""
+        with self.db_conn:
+            self.db_conn.executemany("DELETE FROM outbox WHERE id = ?", [(outbox_id,) for outbox_id in outbox_ids])
+        self.in_flight.difference_update(outbox_ids)
+
+    def close(self):
+        self.db_conn.close()
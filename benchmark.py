@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+from aiohttp import web
+import capture_utils
+import face_utils
+from enrollment_utils import EnrollmentPipeline
+from index_utils import BruteForceSearch, EmbeddingIndex, IVFSearch
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".h264")
+STAGES = ("convert", "detect", "encode", "match")
+DEFAULT_THRESHOLDS = [round(0.30 + 0.05 * i, 2) for i in range(9)] # 0.30 .. 0.70
+DEFAULT_NPROBES = [1, 2, 4, 8, 16, 32]
+
+def latency_stats(samples):
+    """Summarizes latency samples (seconds) in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples) * 1000.0
+    return {"count": len(samples), "mean_ms": float(values.mean()), "p50_ms": float(np.percentile(values, 50)),
+            "p90_ms": float(np.percentile(values, 90)), "p99_ms": float(np.percentile(values, 99)), "max_ms": float(values.max())}
+
+def peak_memory_mb():
+    """Peak resident memory of this process and of its finished children (ru_maxrss is in KiB on Linux)."""
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024 # macOS reports bytes
+    return {"self_peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor,
+            "children_peak_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / divisor}
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def enrollment_students(enroll_dir, base_url):
+    """Builds a server-style student list from <enroll_dir>/<student_id>/<image> files."""
+    students = []
+    for student_id in sorted(os.listdir(enroll_dir)):
+        student_dir = os.path.join(enroll_dir, student_id)
+        if not os.path.isdir(student_dir):
+            continue
+        images = [f"{base_url}/{student_id}/{name}" for name in sorted(os.listdir(student_dir)) if name.lower().endswith(IMAGE_EXTENSIONS)]
+        students.append({"_id": student_id, "name": student_id, "enrollmentNo": student_id, "images": images})
+    return students
+
+async def run_enrollment(enroll_dir, db_path, download_concurrency, workers, batch_size):
+    """Enrolls the directory through the real download/encode/store pipeline, served from a local HTTP server."""
+    app = web.Application()
+    app.router.add_static("/", enroll_dir)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        students = enrollment_students(enroll_dir, f"http://127.0.0.1:{port}")
+        db_conn = sqlite3.connect(db_path)
+        try:
+            face_utils.ensure_schema(db_conn)
+            pipeline = EnrollmentPipeline(face_utils.encode_image, download_concurrency=download_concurrency, workers=workers, batch_size=batch_size)
+            changed = [(student, face_utils.image_hash(student)) for student in students]
+            progress = await pipeline.run(changed, db_conn)
+        finally:
+            db_conn.close()
+    finally:
+        await runner.cleanup()
+    return {
+        "students": progress.students, "images": progress.images, "encoded": progress.encoded,
+        "failed": progress.download_failed + progress.encode_failed, "faces": progress.faces,
+        "seconds": progress.elapsed(), "images_per_second": progress.images_per_second(),
+    }
+
+def replay_sources(paths):
+    """Expands replay arguments into (label, source) pairs; the label is the file or folder name."""
+    sources = []
+    for path in paths:
+        name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+        if os.path.isdir(path):
+            entries = sorted(os.listdir(path))
+            if any(entry.lower().endswith(IMAGE_EXTENSIONS) for entry in entries):
+                sources.append((name, capture_utils.ImageDirectorySource(path, fps=None, loop=False)))
+            else: # A folder of clips or frame folders, one per label
+                sources.extend(replay_sources([os.path.join(path, entry) for entry in entries
+                                               if os.path.isdir(os.path.join(path, entry)) or entry.lower().endswith(VIDEO_EXTENSIONS)]))
+        else:
+            sources.append((name, capture_utils.VideoFileSource(path, fps=None, loop=False)))
+    return sources
+
+def replay(sources, index, known_ids, detection_width, upsample, padding, frame_step, max_frames):
+    """Runs every replay frame through the recognition stages one at a time; returns stage timings, per-frame results and the encodings."""
+    timings = {stage: [] for stage in STAGES}
+    frame_times = []
+    results = [] # (expected student ID or "Unknown", [(predicted ID, distance) per face])
+    encodings = [] # Every face encoding seen, reused as queries by the index sweep
+    for label, source in sources:
+        expected = label if label in known_ids else "Unknown" # Clips named after no enrolled student are strangers
+        shape = source.start()
+        frame = np.empty(shape, np.uint8)
+        frame_number = 0
+        try:
+            while source.read_into(frame):
+                frame_number += 1
+                if (frame_number - 1) % frame_step:
+                    continue
+                started = time.perf_counter()
+                normalized_image, scale = face_utils.detection_image(frame, detection_width)
+                converted = time.perf_counter()
+                face_locations = face_utils.locate_faces(normalized_image, scale, frame.shape, upsample)
+                detected = time.perf_counter()
+                matches = []
+                if face_locations:
+                    face_encodings = face_utils.encode_crops(face_utils.crop_faces(frame, face_locations, padding))
+                    encoded = time.perf_counter()
+                    encodings.extend(face_encodings)
+                    matches = index.match(face_encodings, threshold=float("inf")) # Nearest label at any distance; thresholds are applied below
+                    matched = time.perf_counter()
+                    timings["encode"].append(encoded - detected)
+                    timings["match"].append(matched - encoded)
+                timings["convert"].append(converted - started)
+                timings["detect"].append(detected - converted)
+                frame_times.append(time.perf_counter() - started)
+                results.append((expected, matches))
+                if max_frames and len(results) >= max_frames:
+                    return timings, frame_times, results, encodings
+        finally:
+            source.stop()
+    return timings, frame_times, results, encodings
+
+def accuracy(results, thresholds):
+    """Frame-level precision and recall per distance threshold, using the closest face in each frame."""
+    rows = []
+    for threshold in thresholds:
+        true_positive = false_positive = false_negative = 0
+        for expected, matches in results:
+            predicted = "Unknown"
+            if matches:
+                student_id, distance = min(matches, key=lambda match: match[1])
+                if distance < threshold:
+                    predicted = student_id
+            if predicted != "Unknown":
+                if predicted == expected:
+                    true_positive += 1
+                else:
+                    false_positive += 1 # Wrong student, or a stranger accepted as someone
+            if expected != "Unknown" and predicted != expected:
+                false_negative += 1 # Missed detection, rejected or misidentified
+        rows.append({
+            "threshold": threshold,
+            "precision": true_positive / (true_positive + false_positive) if true_positive + false_positive else None,
+            "recall": true_positive / (true_positive + false_negative) if true_positive + false_negative else None,
+            "true_positive": true_positive, "false_positive": false_positive, "false_negative": false_negative,
+        })
+    return rows
+
+def synthetic_roster(students, images, seed=0):
+    """Random clustered encodings (a center per student plus per-image noise) for sweeping rosters larger than any dataset."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=0.08, size=(students, 128)).astype(np.float32)
+    matrix = np.repeat(centers, images, axis=0) + rng.normal(scale=0.02, size=(students * images, 128)).astype(np.float32)
+    labels = np.empty(students * images, dtype=object)
+    labels[:] = [f"synthetic-{i}" for i in range(students) for _ in range(images)]
+    return labels, matrix
+
+def index_sweep(labels, matrix, queries, nlists, nprobes):
+    """Recall@1 against exact search and per-query latency for each IVF setting."""
+    def timed(search):
+        found, latencies = [], []
+        for query in queries: # One face at a time, as the device matches them
+            started = time.perf_counter()
+            best, _ = search.search(query[None, :])
+            latencies.append(time.perf_counter() - started)
+            found.append(search.labels[best[0]])
+        return found, latencies
+
+    exact_labels, exact_latencies = timed(BruteForceSearch(matrix, labels))
+    rows = [dict({"kind": "brute", "recall": 1.0}, **latency_stats(exact_latencies))]
+    for nlist in nlists:
+        started = time.perf_counter()
+        ivf = IVFSearch(matrix, labels, nlist=nlist or None)
+        build_seconds = time.perf_counter() - started
+        for nprobe in nprobes:
+            if nprobe > ivf.nlist:
+                continue
+            ivf.nprobe = nprobe
+            found, latencies = timed(ivf)
+            recall = sum(1 for got, expected in zip(found, exact_labels) if got == expected) / len(queries)
+            rows.append(dict({"kind": "ivf", "nlist": ivf.nlist, "nprobe": nprobe, "recall": recall, "build_seconds": build_seconds},
+                             **latency_stats(latencies)))
+    return rows
+
+def compare(report, baseline):
+    """Prints the change of the headline numbers against an earlier report."""
+    def pick(data, *keys):
+        for key in keys:
+            data = (data or {}).get(key) if isinstance(data, dict) else None
+        return data
+    rows = [(f"{stage} p50 ms", ("stages", stage, "p50_ms")) for stage in STAGES]
+    rows += [(f"{stage} p99 ms", ("stages", stage, "p99_ms")) for stage in STAGES]
+    rows += [("frames/s", ("replay", "frames_per_second")), ("enrollment images/s", ("enrollment", "images_per_second")),
+             ("peak memory MB", ("memory", "self_peak_mb"))]
+    print(f"Compared with {baseline.get('revision')} ({baseline.get('created')}):")
+    for name, keys in rows:
+        old, new = pick(baseline, *keys), pick(report, *keys)
+        if old is None or new is None:
+            continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"  {name:<22} {old:10.2f} -> {new:10.2f}  ({change})")
+
+def print_report(report):
+    enrollment = report.get("enrollment")
+    if enrollment:
+        print(f"Enrollment: {enrollment['encoded']}/{enrollment['images']} images, {enrollment['faces']} faces, "
+              f"{enrollment['images_per_second']:.2f} images/s")
+    replay_report = report.get("replay")
+    if replay_report:
+        print(f"Replay: {replay_report['frames']} frames, {replay_report['frames_per_second']:.2f} frames/s (single worker)")
+        for stage in STAGES:
+            stats = report["stages"][stage]
+            if stats["count"]:
+                print(f"  {stage:<8} p50 {stats['p50_ms']:8.2f} ms  p90 {stats['p90_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms  ({stats['count']} calls)")
+        for row in report["accuracy"]:
+            precision = "-" if row["precision"] is None else f"{row['precision']:.3f}"
+            recall = "-" if row["recall"] is None else f"{row['recall']:.3f}"
+            print(f"  threshold {row['threshold']:.2f}: precision {precision}  recall {recall}")
+    sweep = report.get("index_sweep")
+    if sweep:
+        print(f"Index sweep: {sweep['encodings']} encodings, {sweep['queries']} queries")
+        for row in sweep["settings"]:
+            name = "brute force" if row["kind"] == "brute" else f"ivf nlist {row['nlist']} nprobe {row['nprobe']}"
+            print(f"  {name:<26} recall@1 {row['recall']:.3f}  p50 {row['p50_ms']:.3f} ms  p99 {row['p99_ms']:.3f} ms")
+    print(f"Peak memory: {report['memory']['self_peak_mb']:.1f} MB (workers {report['memory']['children_peak_mb']:.1f} MB)")
+
+def copy_database(source_path, target_path):
+    """Copies an embeddings database without writing to it (it may be a device's live student_faces.db)."""
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target) # Consistent copy even while another process writes the source
+    finally:
+        source.close()
+        target.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the StreakTrack enrollment and recognition pipeline.")
+    parser.add_argument("--enroll", help="Enrollment directory: one folder per student ID containing that student's images")
+    parser.add_argument("--db", help="Use an existing embeddings database instead of enrolling; it is only read, a copy is benchmarked (with --enroll: where to write the new one)")
+    parser.add_argument("--replay", nargs="*", default=[],
+                        help="Videos or frame folders named after the student ID they show (any other name counts as a stranger)")
+    parser.add_argument("--thresholds", type=float, nargs="*", default=DEFAULT_THRESHOLDS)
+    parser.add_argument("--detection-width", type=int, default=320)
+    parser.add_argument("--upsample", type=int, default=1)
+    parser.add_argument("--padding", type=float, default=0.25)
+    parser.add_argument("--frame-step", type=int, default=1, help="Process every Nth replay frame")
+    parser.add_argument("--max-frames", type=int, default=0)
+    parser.add_argument("--workers", type=int, help="Enrollment encoder processes (default: one per CPU core)")
+    parser.add_argument("--download-concurrency", type=int, default=8)
+    parser.add_argument("--index-sweep", action="store_true", help="Measure IVF recall against exact search for each --nlist/--nprobe")
+    parser.add_argument("--nlist", type=int, nargs="*", default=[0], help="IVF list counts to sweep (0: square root of the encodings)")
+    parser.add_argument("--nprobe", type=int, nargs="*", default=DEFAULT_NPROBES)
+    parser.add_argument("--synthetic-students", type=int, default=0, help="Sweep a generated roster of this many students instead")
+    parser.add_argument("--synthetic-images", type=int, default=3, help="Encodings per generated student")
+    parser.add_argument("--sweep-queries", type=int, default=500)
+    parser.add_argument("--output", default="benchmark.json", help="Where to write the JSON report")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    args = parser.parse_args()
+    if not args.enroll and not args.db and not args.synthetic_students:
+        parser.error("--enroll, --db or --synthetic-students is required")
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "platform": {"machine": platform.machine(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "settings": {"detection_width": args.detection_width, "upsample": args.upsample, "padding": args.padding,
+                     "frame_step": args.frame_step, "workers": args.workers, "download_concurrency": args.download_concurrency},
+    }
+    encodings = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_path = args.db or os.path.join(work_dir, "benchmark_faces.db")
+        if args.db and not args.enroll:
+            if not os.path.exists(args.db):
+                parser.error(f"{args.db} does not exist")
+            # Loading migrates old formats and writes a snapshot next to the database: do that to a copy
+            db_path = os.path.join(work_dir, "benchmark_faces.db")
+            copy_database(args.db, db_path)
+        if args.enroll:
+            if args.db and os.path.exists(args.db):
+                parser.error(f"{args.db} already exists; remove it or drop --enroll")
+            report["enrollment"] = asyncio.run(run_enrollment(args.enroll, db_path, args.download_concurrency, args.workers, 50))
+        index = EmbeddingIndex(db_path, index_type="brute") # Exact, so accuracy does not depend on the ANN settings
+        if args.enroll or args.db:
+            index.reload()
+            known_ids = index.student_ids()
+            report["index"] = {"encodings": len(index), "students": len(known_ids)}
+
+        if args.replay and (args.enroll or args.db):
+            timings, frame_times, results, encodings = replay(replay_sources(args.replay), index, known_ids, args.detection_width,
+                                                   args.upsample, args.padding, max(1, args.frame_step), args.max_frames)
+            total = sum(frame_times)
+            report["replay"] = {"frames": len(frame_times), "frames_with_faces": sum(1 for _, matches in results if matches),
+                                "seconds": total, "frames_per_second": len(frame_times) / total if total else 0.0,
+                                "frame": latency_stats(frame_times)}
+            report["stages"] = {stage: latency_stats(samples) for stage, samples in timings.items()}
+            report["accuracy"] = accuracy(results, sorted(args.thresholds))
+
+        if args.index_sweep or args.synthetic_students:
+            if args.synthetic_students:
+                labels, matrix = synthetic_roster(args.synthetic_students, args.synthetic_images)
+            else:
+                labels, matrix = index.contents()
+            rng = np.random.default_rng(1)
+            if encodings: # Real faces from the replay
+                queries = np.asarray(encodings, dtype=np.float32)[:args.sweep_queries]
+            else: # Stored encodings with a little noise, like a new photo of an enrolled student
+                picks = rng.choice(len(labels), min(len(labels), args.sweep_queries), replace=False)
+                queries = matrix[picks] + rng.normal(scale=0.02, size=(len(picks), matrix.shape[1])).astype(np.float32)
+            if len(labels) and len(queries):
+                report["index_sweep"] = {"encodings": len(labels), "queries": len(queries),
+                                         "settings": index_sweep(labels, matrix, queries, args.nlist, sorted(args.nprobe))}
+    report["memory"] = peak_memory_mb()
+
+    print_report(report)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
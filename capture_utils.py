@@ -0,0 +1,336 @@
+import os
+import threading
+import time
+import cv2
+import numpy as np
+
+class FrameRef:
+    """A borrowed, read-only view of one ring slot; release() it as soon as the frame is no longer needed."""
+
+    def __init__(self, ring, slot, sequence, timestamp, frame, captured_at=None):
+        self.ring = ring
+        self.slot = slot
+        self.sequence = sequence
+        self.timestamp = timestamp # time.monotonic() at capture, for latencies
+        self.captured_at = captured_at # time.time() at capture, for the stream header
+        self.frame = frame
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.ring._release(self.slot)
+
+class FrameRing:
+    """Fixed ring of preallocated frame buffers written by the capture thread and borrowed by consumers."""
+
+    def __init__(self, slots, shape, dtype=np.uint8):
+        self.slots = max(3, slots)
+        self._buffers = [np.empty(shape, dtype) for _ in range(self.slots)]
+        self._views = []
+        for buffer in self._buffers:
+            view = buffer.view()
+            view.flags.writeable = False # Consumers can never scribble over a frame another consumer is reading
+            self._views.append(view)
+        self._sequences = [0] * self.slots
+        self._timestamps = [0.0] * self.slots
+        self._captured_at = [0.0] * self.slots
+        self._borrowed = [0] * self.slots
+        self._read = [True] * self.slots
+        self._latest = None
+        self._lock = threading.Lock()
+        self.sequence = 0 # Sequence number of the newest committed frame
+        self.unread_dropped = 0 # Frames overwritten before any consumer looked at them
+        self.full_dropped = 0 # Frames discarded because every slot was borrowed
+
+    def writable_slot(self):
+        """Returns the index and buffer of the oldest slot that is neither borrowed nor the latest frame, or None."""
+        with self._lock:
+            candidates = [slot for slot in range(self.slots) if slot != self._latest and not self._borrowed[slot]]
+            if not candidates:
+                self.full_dropped += 1
+                return None
+            slot = min(candidates, key=lambda candidate: self._sequences[candidate])
+            if not self._read[slot]:
+                self.unread_dropped += 1 # Never consumed, dropped without a copy
+            self._sequences[slot] = 0 # Invisible to acquire() while being written
+            return slot, self._buffers[slot]
+
+    def commit(self, slot, timestamp=None):
+        """Publishes a freshly written slot as the latest frame."""
+        with self._lock:
+            self.sequence += 1
+            self._sequences[slot] = self.sequence
+            self._timestamps[slot] = time.monotonic() if timestamp is None else timestamp
+            self._captured_at[slot] = time.time()
+            self._read[slot] = False
+            self._latest = slot
+
+    def acquire(self, after_sequence=0):
+        """Borrows the latest frame if it is newer than after_sequence; returns a FrameRef or None."""
+        with self._lock:
+            slot = self._latest
+            if slot is None or self._sequences[slot] <= after_sequence:
+                return None
+            self._borrowed[slot] += 1
+            self._read[slot] = True
+            return FrameRef(self, slot, self._sequences[slot], self._timestamps[slot], self._views[slot], self._captured_at[slot])
+
+    def _release(self, slot):
+        with self._lock:
+            self._borrowed[slot] -= 1
+
+class PicameraSource:
+    """Raspberry Pi camera via Picamera2."""
+
+    def __init__(self, width=640, height=480, camera_num=0):
+        self.width = width
+        self.height = height
+        self.camera_num = camera_num # CSI connector, for boards with two camera ports (Pi 5, CM4)
+        self.picam2 = None
+
+    def start(self):
+        """Starts the camera and returns the shape of its frames."""
+        from picamera2 import Picamera2
+        self.picam2 = Picamera2(self.camera_num)
+        config = self.picam2.create_preview_configuration(main={"size": (self.width, self.height)})
+        self.picam2.configure(config)
+        self.picam2.start()
+        return self.picam2.capture_array().shape
+
+    def read_into(self, buffer):
+        np.copyto(buffer, self.picam2.capture_array()) # Picamera2 hands out its own array; one copy into the ring
+        return True
+
+    def stop(self):
+        if self.picam2:
+            self.picam2.stop()
+
+class VideoFileSource:
+    """Video file (or any OpenCV capture URL) played back at a fixed rate, looping at the end."""
+
+    def __init__(self, path, fps=None, loop=True):
+        self.path = path
+        self.fps = fps # None plays as fast as frames are read
+        self.loop = loop
+        self.capture = None
+        self._next_frame = 0.0
+
+    def start(self):
+        self.capture = cv2.VideoCapture(self.path)
+        ok, frame = self.capture.read()
+        if not ok:
+            raise RuntimeError(f"Cannot read video source {self.path}")
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return frame.shape
+
+    def read_into(self, buffer):
+        if self.fps:
+            delay = self._next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_frame = max(self._next_frame, time.monotonic()) + 1.0 / self.fps
+        ok, frame = self.capture.read(buffer) # Decodes straight into the ring buffer when the shape matches
+        if not ok and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.capture.read(buffer)
+        if not ok:
+            return False
+        if frame is not buffer and not np.shares_memory(frame, buffer):
+            np.copyto(buffer, frame)
+        return True
+
+    def stop(self):
+        if self.capture:
+            self.capture.release()
+
+class LiveCaptureSource:
+    """USB/V4L2 camera (device index or /dev path) or network stream (RTSP URL) read through OpenCV; reopened when it drops."""
+
+    def __init__(self, device, width=None, height=None, reconnect_delay=2.0):
+        self.device = device
+        self.width = width
+        self.height = height
+        self.reconnect_delay = reconnect_delay
+        self.capture = None
+        self.shape = None
+
+    def _open(self):
+        self.capture = cv2.VideoCapture(self.device)
+        if self.width and self.height: # Only a request: the driver may pick the nearest mode it supports
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1) # The ring keeps only the newest frames anyway
+
+    def start(self):
+        self._open()
+        ok, frame = self.capture.read()
+        if not ok:
+            raise RuntimeError(f"Cannot read camera {self.device}")
+        self.shape = frame.shape
+        return self.shape
+
+    def read_into(self, buffer):
+        ok, frame = self.capture.read(buffer)
+        if not ok:
+            self.capture.release()
+            time.sleep(self.reconnect_delay)
+            self._open()
+            raise RuntimeError(f"Lost camera {self.device}, reconnecting")
+        if frame.shape != self.shape: # A reconnected stream may come back in another mode
+            cv2.resize(frame, (self.shape[1], self.shape[0]), dst=buffer)
+        elif frame is not buffer and not np.shares_memory(frame, buffer):
+            np.copyto(buffer, frame)
+        return True
+
+    def stop(self):
+        if self.capture:
+            self.capture.release()
+
+class ImageDirectorySource:
+    """Still images from a directory played back in name order at a fixed rate, as if they were camera frames."""
+
+    EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+    def __init__(self, path, fps=None, loop=True):
+        self.path = path
+        self.fps = fps
+        self.loop = loop
+        self.files = []
+        self.shape = None
+        self._index = 0
+        self._next_frame = 0.0
+
+    def start(self):
+        self.files = sorted(os.path.join(self.path, name) for name in os.listdir(self.path) if name.lower().endswith(self.EXTENSIONS))
+        if not self.files:
+            raise RuntimeError(f"No images found in {self.path}")
+        first = cv2.imread(self.files[0])
+        if first is None:
+            raise RuntimeError(f"Cannot read image {self.files[0]}")
+        self.shape = first.shape # Every other image is resized to this
+        return self.shape
+
+    def read_into(self, buffer):
+        if self.fps:
+            delay = self._next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_frame = max(self._next_frame, time.monotonic()) + 1.0 / self.fps
+        if self._index >= len(self.files):
+            if not self.loop:
+                return False
+            self._index = 0
+        image = cv2.imread(self.files[self._index])
+        self._index += 1
+        if image is None:
+            raise RuntimeError(f"Cannot read image {self.files[self._index - 1]}")
+        if image.shape != self.shape:
+            cv2.resize(image, (self.shape[1], self.shape[0]), dst=buffer)
+        else:
+            np.copyto(buffer, image)
+        return True
+
+    def stop(self):
+        pass
+
+class SyntheticSource:
+    """Generated frames (a bright square sweeping over a flat background) for tests without a camera."""
+
+    def __init__(self, width=640, height=480, fps=30):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self._index = 0
+        self._next_frame = 0.0
+
+    def start(self):
+        return (self.height, self.width, 3)
+
+    def read_into(self, buffer):
+        if self.fps:
+            delay = self._next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_frame = max(self._next_frame, time.monotonic()) + 1.0 / self.fps
+        buffer[:] = 40
+        size = self.height // 4
+        x = (self._index * 8) % max(1, self.width - size)
+        buffer[size:2 * size, x:x + size] = 220
+        self._index += 1
+        return True
+
+    def stop(self):
+        pass
+
+def create_source(config, default="picamera"):
+    """Builds the camera backend named by config["camera_source"] ("picamera", "v4l2", "rtsp", "file", "images" or "synthetic")."""
+    kind = config.get("camera_source", default)
+    width = config.get("camera_width", 640)
+    height = config.get("camera_height", 480)
+    if kind in ("v4l2", "usb"):
+        return LiveCaptureSource(config.get("camera_path", 0), width, height) # Device index (0 is /dev/video0) or path
+    if kind == "rtsp":
+        return LiveCaptureSource(config["camera_path"], reconnect_delay=config.get("camera_reconnect_delay", 2.0))
+    if kind == "file":
+        return VideoFileSource(config["camera_path"], fps=config.get("camera_fps"), loop=config.get("camera_loop", True))
+    if kind == "images":
+        return ImageDirectorySource(config["camera_path"], fps=config.get("camera_fps", 10), loop=config.get("camera_loop", True))
+    if kind == "synthetic":
+        return SyntheticSource(width, height, fps=config.get("camera_fps", 30))
+    return PicameraSource(width, height, config.get("camera_num", 0))
+
+def camera_configs(config):
+    """Returns one config per camera: the entries of config["cameras"] laid over the top-level config, or just the top level."""
+    cameras = config.get("cameras") or [{}]
+    configs = []
+    for i, camera in enumerate(cameras):
+        merged = dict(config, camera_name=f"camera{i}")
+        merged.update(camera)
+        configs.append(merged)
+    return configs
+
+class CaptureThread(threading.Thread):
+    """Reads frames from a source into a FrameRing on its own thread, off the event loop."""
+
+    def __init__(self, source, slots=8, name="capture"):
+        super().__init__(name=name, daemon=True)
+        self.source = source
+        self.slots = slots
+        self.ring = None
+        self.frames = 0
+        self.fps = 0.0 # Frames committed per second, over the last full second
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """Starts the source, allocates the ring for its frame shape and begins capturing."""
+        shape = self.source.start()
+        self.ring = FrameRing(self.slots, shape)
+        self._scratch = np.empty(shape, np.uint8) # Absorbs frames while every slot is borrowed
+        super().start()
+        return self.ring
+
+    def run(self):
+        window_start, window_frames = time.monotonic(), 0
+        while not self._stop_event.is_set():
+            writable = self.ring.writable_slot()
+            slot, buffer = writable if writable else (None, self._scratch) # Keep the camera drained even when the ring is full
+            try:
+                if not self.source.read_into(buffer):
+                    print("Capture source ended.")
+                    break
+            except Exception as e:
+                print(f"Error capturing frame: {e}")
+                time.sleep(0.1)
+                continue
+            if slot is not None:
+                self.ring.commit(slot)
+                self.frames += 1
+            now = time.monotonic()
+            if now - window_start >= 1.0:
+                self.fps = (self.frames - window_frames) / (now - window_start)
+                window_start, window_frames = now, self.frames
+        self.source.stop()
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import json
+import websockets
+import stream_utils
+
+def total(values, name):
+    """Sums a metric over its label sets (e.g. the capture rate of every camera)."""
+    return sum(value for key, value in values.items() if key.split("{")[0] == name and isinstance(value, (int, float)))
+
+async def handle_device(websocket, students, stream, ack, stream_camera=None):
+    """Sends the roster to a connected device and prints everything it sends back."""
+    print("Device connected.")
+    await websocket.send(json.dumps({"students": students}))
+    if stream:
+        await websocket.send(json.dumps({"type": "start_stream", "camera": stream_camera}))
+    frames = 0
+    try:
+        async for message in websocket:
+            if isinstance(message, bytes):
+                header, jpeg = stream_utils.unpack_frame(message)
+                frames += 1
+                if frames % 50 == 1:
+                    print(f"Binary frame #{header['sequence']} from camera {header['source']}: {header['width']}x{header['height']} q{header['quality']}, {len(jpeg)} bytes")
+                continue
+            data = json.loads(message)
+            messages = data["messages"] if data.get("type") == "batch" else [data]
+            if data.get("type") == "live_stream":
+                frames += 1
+                if frames % 50 == 1:
+                    print(f"JSON frame from {data.get('camera')}, {len(data['frame'])} base64 chars")
+                continue
+            for item in messages:
+                if item.get("type") == "metrics":
+                    values = item.get("metrics", {})
+                    print(f"metrics: {total(values, 'streaktrack_capture_fps'):.1f} capture fps, "
+                          f"{total(values, 'streaktrack_recognition_queue_depth')} queued, "
+                          f"{values.get('streaktrack_outbox_pending')} outbox, {len(values)} series")
+                    continue
+                student = item.get("student", {})
+                print(f"{item.get('type')}: {student.get('name')} ({student.get('studentId')}) at {student.get('timestamp')}")
+            event_ids = [item["eventId"] for item in messages if "eventId" in item]
+            if ack and event_ids:
+                await websocket.send(json.dumps({"type": "ack", "eventIds": event_ids}))
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    print("Device disconnected.")
+
+async def serve(host, port, students, stream, ack, stream_camera=None):
+    async with websockets.serve(lambda websocket, *args: handle_device(websocket, students, stream, ack, stream_camera), host, port):
+        print(f"Stand-in StreakTrack server listening on ws://{host}:{port}")
+        await asyncio.Future()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the StreakTrack WebSocket server.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=3001)
+    parser.add_argument("--students", help="JSON file with the student list to send (same format as the server)")
+    parser.add_argument("--stream", action="store_true", help="Ask the device to start streaming after connecting")
+    parser.add_argument("--stream-camera", help="Name of the camera to stream (default: the device's first camera)")
+    parser.add_argument("--ack", action="store_true", help="Acknowledge attendance events (for outbox_require_ack)")
+    args = parser.parse_args()
+    students = []
+    if args.students:
+        with open(args.students) as f:
+            students = json.load(f)
+    asyncio.run(serve(args.host, args.port, students, args.stream, args.ack, args.stream_camera))
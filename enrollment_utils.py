@@ -0,0 +1,137 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from index_utils import pack_encodings
+from pool_utils import init_worker_process, process_context
+
+class EnrollmentProgress:
+    """Per-stage counters for one enrollment run."""
+
+    def __init__(self, students=0, images=0):
+        self.students = students
+        self.images = images
+        self.downloaded = 0
+        self.download_failed = 0
+        self.bytes_downloaded = 0
+        self.encoded = 0
+        self.encode_failed = 0
+        self.faces = 0
+        self.stored = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def images_per_second(self):
+        elapsed = self.elapsed()
+        return self.encoded / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return (f"{self.stored}/{self.students} students stored, "
+                f"{self.downloaded}/{self.images} images downloaded ({self.download_failed} failed), "
+                f"{self.encoded} encoded ({self.encode_failed} failed, {self.faces} faces), "
+                f"{self.images_per_second():.1f} images/s")
+
+class EnrollmentPipeline:
+    """Staged enrollment: pooled concurrent downloads -> decode/encode on a worker pool -> batched SQLite writer."""
+
+    def __init__(self, encode_fn, download_concurrency=8, workers=None, batch_size=50, executor=None):
+        self.encode_fn = encode_fn # Module-level function taking image bytes and returning a list of encodings
+        self.download_concurrency = max(1, download_concurrency)
+        # An existing RecognitionExecutor whose warm workers do the encoding; without one, a process pool of
+        # `workers` is started for the run (each process loads its own copy of dlib's models)
+        self.executor = executor
+        self.workers = executor.workers if executor else max(1, workers or os.cpu_count() or 1)
+        self.batch_size = max(1, batch_size)
+        self.progress = EnrollmentProgress()
+
+    async def run(self, changed_students, db_conn):
+        """Downloads, encodes and stores the given (student, image hash) pairs, then commits the last batch."""
+        self.progress = EnrollmentProgress(len(changed_students), sum(len(student.get('images') or []) for student, _ in changed_students))
+        self._download_slots = asyncio.Semaphore(self.download_concurrency)
+        # Bounds downloaded-but-not-yet-encoded images so memory stays flat when encoding is the bottleneck
+        self._inflight_slots = asyncio.Semaphore(max(self.download_concurrency, self.workers * 2))
+        write_queue = asyncio.Queue()
+        # At most one image per worker is handed to the pool, so recognition frames on a shared pool never queue behind a backlog
+        self._encode_slots = asyncio.Semaphore(self.workers)
+        writer = asyncio.create_task(self._write_batches(write_queue, db_conn))
+        self._pool = None if self.executor else ProcessPoolExecutor(max_workers=self.workers, mp_context=process_context(), initializer=init_worker_process)
+        try:
+            import aiohttp # Only needed once a sync starts, so it stays out of the boot path
+            connector = aiohttp.TCPConnector(limit=self.download_concurrency) # One pooled session for every download
+            async with aiohttp.ClientSession(connector=connector) as session:
+                await asyncio.gather(*(self._enroll_student(session, student, student_hash, write_queue)
+                                       for student, student_hash in changed_students))
+        finally:
+            await write_queue.put(None)
+            await writer
+            if self._pool:
+                self._pool.shutdown()
+        self.progress.finished = time.monotonic()
+        print(f"Enrollment finished: {self.progress.summary()}")
+        return self.progress
+
+    async def _enroll_student(self, session, student, student_hash, write_queue):
+        """Runs every image of one student through the download and encode stages, then queues the row."""
+        if not student.get('images'):
+            print(f"No images found for {student['name']}")
+        results = await asyncio.gather(*(self._process_image(session, image_url) for image_url in student.get('images') or []))
+        succeeded = [encodings for encodings in results if encodings is not None]
+        if results and not succeeded:
+            return # Nothing new to store: the old row (if any) stays in use and every image is retried on the next sync
+        all_face_encodings = [encoding for encodings in succeeded for encoding in encodings]
+        if not all_face_encodings:
+            print(f"No valid faces found for {student['name']}")
+        if len(succeeded) < len(results):
+            # Store what worked so the student can be recognized now, but with no hash, so the next sync retries
+            print(f"{len(results) - len(succeeded)} image(s) of {student['name']} failed; stored the rest and will retry.")
+            student_hash = None
+        # An empty list with a hash records that these images have no usable face, so they are not downloaded again
+        await write_queue.put((student['_id'], pack_encodings(all_face_encodings), student_hash))
+
+    async def _process_image(self, session, image_url):
+        """Downloads and encodes one image; returns its encodings, or None if it failed."""
+        async with self._inflight_slots:
+            try:
+                async with self._download_slots:
+                    async with session.get(image_url) as response:
+                        response.raise_for_status()
+                        image_data = await response.read()
+                self.progress.downloaded += 1
+                self.progress.bytes_downloaded += len(image_data)
+            except Exception as e:
+                print(f"Error downloading {image_url}: {e}")
+                self.progress.download_failed += 1
+                return None
+            try:
+                # Decoding and dlib encoding run in a worker process so every core is used and the loop never blocks
+                async with self._encode_slots:
+                    if self.executor:
+                        encodings = await self.executor.run(self.encode_fn, image_data)
+                    else:
+                        encodings = await asyncio.get_running_loop().run_in_executor(self._pool, self.encode_fn, image_data)
+            except Exception as e:
+                print(f"Error encoding {image_url}: {e}")
+                self.progress.encode_failed += 1
+                return None
+            self.progress.encoded += 1
+            self.progress.faces += len(encodings)
+            return encodings
+
+    async def _write_batches(self, write_queue, db_conn):
+        """Writes queued rows with one executemany and commit per batch."""
+        batch = []
+        while True:
+            row = await write_queue.get()
+            if row is not None:
+                batch.append(row)
+            if batch and (row is None or len(batch) >= self.batch_size):
+                db_conn.executemany("INSERT OR REPLACE INTO students (student_id, encoding, image_hash) VALUES (?, ?, ?)", batch)
+                db_conn.commit()
+                self.progress.stored += len(batch)
+                batch = []
+                print(f"Enrollment progress: {self.progress.summary()}")
+            if row is None:
+                return
@@ -1,112 +1,179 @@
-import asyncio
-import aiohttp
-import face_recognition
+import hashlib
+import os
 import numpy as np
-import pickle
 import sqlite3
 import cv2
-from picamera2 import Picamera2
 import time
+from index_utils import EmbeddingIndex, migrate_encodings
+from enrollment_utils import EnrollmentPipeline
 
-async def download_image(session, url):
-    """Downloads an image from a given URL asynchronously."""
-    async with session.get(url) as response:
-        return await response.read()
-
-async def encode_and_store_students(students):
-    """Encodes face embeddings for all students and stores them in a database."""
-    db_conn = sqlite3.connect('student_faces.db')
-    db_conn.execute("DROP TABLE IF EXISTS students") # Drop the table if it exists, then create it to ensure a fresh start
-    db_conn.execute("CREATE TABLE IF NOT EXISTS students (student_id TEXT PRIMARY KEY, encoding BLOB)") # Create a table to store student IDs and their face encodings (as BLOB data)
-    await process_students(students, db_conn) # Process each student to download images, encode faces, and store in the database
-    db_conn.close()
-
-async def encode_and_store(student, db_conn):
-    """Downloads images for a single student, encodes detected faces, and stores the encodings in the database."""
-    async with aiohttp.ClientSession() as session:
-        all_face_encodings = []
-        if student['images']:
-            for image_url in student['images']:
-                try:
-                    image_data = await download_image(session, image_url) # Download the image data from the URL
-                    image_array = np.frombuffer(image_data, np.uint8) # Convert the downloaded image data to a NumPy array
-                    image = cv2.imdecode(image_array, cv2.IMREAD_COLOR) # Decode the NumPy array into an OpenCV image object
-                    if image is not None:
-                        face_encs = face_recognition.face_encodings(image) # Detect face locations in the image using the HOG model (fast but less accurate than CNN)
-                        if face_encs:
-                            all_face_encodings.extend(face_encs) # Extend the list with all face encodings found in the current image
-                except Exception as e:
-                    print(f"Error processing {image_url}: {e}")
-        else:
-            print(f"No images found for {student['name']}")
-
-        if all_face_encodings:
-            db_conn.execute("INSERT OR REPLACE INTO students (student_id, encoding) VALUES (?, ?)",  # Store all encoded faces associated with the student's ID in the database
-                            (student['_id'], pickle.dumps(all_face_encodings)))
-            db_conn.commit()
-        else:
-            print(f"No valid faces found for {student['name']}")
-
-async def process_students(students, db_conn):
-    """Asynchronously processes a list of students to encode and store their face embeddings."""
-    tasks = [encode_and_store(student, db_conn) for student in students] # Create a list of tasks, where each task is to encode and store a single student's faces
-    await asyncio.gather(*tasks) # Run all the encoding and storing tasks concurrently
-
-def setup_camera(width=640, height=480):
-    """Sets up and initializes the Raspberry Pi camera."""
-    picam2 = Picamera2()
-    config = picam2.create_preview_configuration(main={"size": (width, height)})
-    picam2.configure(config)
-    picam2.start()
-    return picam2
+DB_FILE = 'student_faces.db'
+MATCH_THRESHOLD = 0.5 # Adjust threshold as needed (very similar enough < 0.5 < not similar enough)
 
-def recognize_face(frame):
-    """Recognizes a face in the input frame by comparing it to the stored face embeddings."""
-    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) # Convert the BGR frame (OpenCV's default) to RGB (face_recognition's requirement)
-    gray_image = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2GRAY)  # Convert the RGB frame to grayscale for histogram equalization
+embedding_index = EmbeddingIndex(DB_FILE) # Resident copy of every stored encoding, shared by all recognitions
+enrollment_pipeline = None # Pipeline of the running or last student sync (its progress feeds the metrics)
+face_recognition = None # Imported on first use: dlib and its models take seconds to load on a Pi
+
+def load_face_recognition():
+    """Imports face_recognition (and dlib's models) once per process."""
+    global face_recognition
+    if face_recognition is None:
+        import face_recognition as module
+        face_recognition = module
+    return face_recognition
+
+def warm_up():
+    """Loads the models and runs one dummy detection and encoding so the first real frame is not slow; returns seconds."""
+    started = time.monotonic()
+    models = load_face_recognition()
+    image = np.zeros((120, 160, 3), np.uint8)
+    models.face_locations(image[:, :, 0], number_of_times_to_upsample=1, model="hog")
+    models.face_encodings(image, [(20, 120, 100, 40)]) # A given box runs the landmark and encoder networks even on a blank image
+    return time.monotonic() - started
+
+def image_hash(student):
+    """Returns a key for a student's images (hash of the image URLs, in order) used to detect changes."""
+    digest = hashlib.sha256()
+    for image_url in student.get('images') or []:
+        digest.update(image_url.encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+def ensure_schema(db_conn):
+    """Creates the students table, adding the image_hash column to databases written by older versions."""
+    db_conn.execute("CREATE TABLE IF NOT EXISTS students (student_id TEXT PRIMARY KEY, encoding BLOB, image_hash TEXT)") # Student IDs, their face encodings (as BLOB data) and the hash of the images they came from
+    columns = [row[1] for row in db_conn.execute("PRAGMA table_info(students)")]
+    if 'image_hash' not in columns:
+        db_conn.execute("ALTER TABLE students ADD COLUMN image_hash TEXT") # Old rows get a NULL hash and are re-encoded once
+    migrate_encodings(db_conn) # Pickled encodings from older versions become packed float32
+
+async def encode_and_store_students(students, download_concurrency=8, workers=None, batch_size=50, executor=None):
+    """Incrementally syncs face embeddings: only new or changed students are encoded, removed ones are pruned."""
+    global enrollment_pipeline
+    tmp_path = DB_FILE + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path) # Leftover from an interrupted sync
+    db_conn = sqlite3.connect(tmp_path)
+    try:
+        if os.path.exists(DB_FILE):
+            old_conn = sqlite3.connect(DB_FILE)
+            old_conn.backup(db_conn) # Start from a copy so the live database stays untouched until the sync completes
+            old_conn.close()
+        ensure_schema(db_conn)
+
+        stored_hashes = dict(db_conn.execute("SELECT student_id, image_hash FROM students"))
+        current_ids = set()
+        changed = []
+        for student in students:
+            current_ids.add(student['_id'])
+            student_hash = image_hash(student)
+            if stored_hashes.get(student['_id']) != student_hash:
+                changed.append((student, student_hash))
+        removed = [student_id for student_id in stored_hashes if student_id not in current_ids]
+
+        db_conn.executemany("DELETE FROM students WHERE student_id = ?", [(student_id,) for student_id in removed])
+        print(f"Student sync: {len(changed)} new/changed, {len(students) - len(changed)} unchanged, {len(removed)} removed.")
+        db_conn.commit()
+        # Download images, encode faces and store them only for new or changed students
+        enrollment_pipeline = EnrollmentPipeline(encode_image, download_concurrency=download_concurrency, workers=workers, batch_size=batch_size, executor=executor)
+        await enrollment_pipeline.run(changed, db_conn)
+    finally:
+        db_conn.close()
+    os.replace(tmp_path, DB_FILE) # Atomic swap: recognition keeps using the old database until the new one is complete
+    return [student['_id'] for student, _ in changed], removed
+
+def encode_image(image_data):
+    """Decodes downloaded image bytes and returns the encodings of every face in it (runs in a worker process)."""
+    image_array = np.frombuffer(image_data, np.uint8) # Convert the downloaded image data to a NumPy array
+    image = cv2.imdecode(image_array, cv2.IMREAD_COLOR) # Decode the NumPy array into an OpenCV image object
+    if image is None:
+        return []
+    return load_face_recognition().face_encodings(image) # Detect faces with the HOG model (fast but less accurate than CNN) and encode them
+
+def reload_embeddings():
+    """Reloads the resident embedding index from the database (call at startup)."""
+    return embedding_index.reload()
+
+def update_embeddings(changed_ids, removed_ids):
+    """Applies a student sync to the resident index, re-reading only the changed students (full reload on error)."""
+    try:
+        embedding_index.apply_changes(changed_ids, removed_ids)
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Incremental index update failed ({e}); reloading.")
+        embedding_index.reload()
+
+def restrict_matching(student_ids):
+    """Matches only against the given students (e.g. the current class), or everyone again with None."""
+    embedding_index.restrict(student_ids)
+
+def detection_image(frame, detection_width=320):
+    """Returns the downscaled, equalized grayscale image faces are detected on, and its scale relative to the frame."""
+    height, width = frame.shape[:2]
+    scale = detection_width / width if detection_width and detection_width < width else 1.0 # HOG cost no longer grows with camera resolution
+    if scale < 1.0:
+        small = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    else:
+        small = frame
+    gray_image = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) # Straight from the camera frame to grayscale, no intermediate RGB copy
     normalized_image = cv2.equalizeHist(gray_image)  # Apply histogram equalization to improve contrast in the grayscale image, aiding face detection
+    return normalized_image, scale
+
+def locate_faces(normalized_image, scale, frame_shape, upsample=1):
+    """Runs HOG detection on a detection image and maps the boxes back to full-resolution coordinates."""
+    height, width = frame_shape[:2]
     # Detect the locations of faces in the normalized grayscale image using the HOG model
-    face_locations = face_recognition.face_locations(normalized_image, model="hog") # Using hog for speed
-
-    if face_locations:
-        # Encode the detected faces in the RGB frame to get their feature embeddings
-        face_encodings = face_recognition.face_encodings(frame_rgb, face_locations)
-
-        if face_encodings:
-            # Connect to the SQLite database containing the stored student face embeddings
-            db_conn = sqlite3.connect('student_faces.db')
-            cursor = db_conn.cursor()
-            # Retrieve all student IDs and their corresponding face embeddings from the database
-            cursor.execute("SELECT student_id, encoding FROM students")
-            results = cursor.fetchall()
-            # Close the database connection
-            db_conn.close()
-
-            for face_encoding in face_encodings:
-                best_match = None
-                min_distance = 0.5  # Adjust threshold as needed (very similar enough < 0.5 < not similar enough)
-
-                for student_id, encoded_data in results:
-                    # Load the stored face embeddings for the current student from the BLOB data
-                    known_encodings = pickle.loads(encoded_data)
-                    # Iterate through all the stored encodings for the current student (a student have multiple images)
-                    for known_encoding in known_encodings:
-                        # Calculate the Euclidean distance between the detected face's encoding and the known encoding
-                        distance = face_recognition.face_distance([known_encoding], face_encoding)[0]
-                        # If the calculated distance is less than the current minimum distance, update the best match
-                        if distance < min_distance:
-                            min_distance = distance
-                            best_match = student_id
-
-                # If a best match is found (distance is below the threshold), return the student ID
-                if best_match:
-                    return best_match
-                else:
-                    # If no match is found below the threshold, return "Unknown"
-                    return "Unknown"
-
-    # If no faces are detected in the frame, return None
-    return None
+    face_locations = load_face_recognition().face_locations(normalized_image, number_of_times_to_upsample=upsample, model="hog") # Using hog for speed
+    # Map the (top, right, bottom, left) boxes back to full-resolution coordinates
+    return [(max(0, int(top / scale)), min(width, int(right / scale)), min(height, int(bottom / scale)), max(0, int(left / scale)))
+            for top, right, bottom, left in face_locations]
+
+def detect_faces(frame, detection_width=320, upsample=1):
+    """Finds faces on a downscaled, equalized grayscale copy of the frame and returns full-resolution boxes."""
+    normalized_image, scale = detection_image(frame, detection_width)
+    return locate_faces(normalized_image, scale, frame.shape, upsample)
+
+def crop_faces(frame, face_locations, padding=0.25):
+    """Cuts a padded RGB crop around each face box; returns (crop, box relative to the crop) pairs."""
+    height, width = frame.shape[:2]
+    crops = []
+    for top, right, bottom, left in face_locations:
+        pad = int((bottom - top) * padding) # Margin so the landmark model sees the whole face
+        y0, y1 = max(0, top - pad), min(height, bottom + pad)
+        x0, x1 = max(0, left - pad), min(width, right + pad)
+        crop_rgb = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2RGB) # Only the crop is converted to RGB (face_recognition's requirement)
+        crops.append((crop_rgb, (top - y0, right - x0, bottom - y0, left - x0)))
+    return crops
+
+def encode_crops(crops):
+    """Computes one encoding per (crop, box) pair."""
+    models = load_face_recognition()
+    return [models.face_encodings(crop_rgb, [box])[0] for crop_rgb, box in crops]
+
+def detect_and_encode(frame, detection_width=320, padding=0.25, upsample=1):
+    """Detects faces in the frame and returns their locations and encodings (safe to run in a worker process)."""
+    face_locations = detect_faces(frame, detection_width, upsample)
+    if not face_locations:
+        return [], []
+    # Encode the detected faces on full-resolution crops to get their feature embeddings
+    face_encodings = encode_crops(crop_faces(frame, face_locations, padding))
+    return face_locations, face_encodings
+
+def match_encodings(face_encodings):
+    """Matches every face encoding against the embedding index; returns a list of (student_id, distance)."""
+    return embedding_index.match(face_encodings, threshold=MATCH_THRESHOLD)
+
+def recognize_faces(frame):
+    """Recognizes every face in the input frame; returns a list of (student_id, distance, box)."""
+    face_locations, face_encodings = detect_and_encode(frame)
+    if not face_locations:
+        return []
+    return [(student_id, distance, box) for (student_id, distance), box in zip(match_encodings(face_encodings), face_locations)]
+
+def recognize_face(frame):
+    """Recognizes a face in the input frame by comparing it to the stored face embeddings."""
+    matches = recognize_faces(frame)
+    # Result for the first face: a student ID, "Unknown" if no match is below the threshold, or None if no faces are detected
+    return matches[0][0] if matches else None
 
 def get_student_name(student_id, students):
     """Retrieves the name of a student given their ID from the list of student data."""
@@ -0,0 +1,174 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import utils
+
+LCD_COLS = 20
+LCD_ROWS = 4
+WELCOME_LINES = ["Welcome", "   to", "StreakTrack"]
+
+def attendance_summary(marked, already_marked, unknown_count):
+    """Combines attendance results (student names) into a single LCD message."""
+    if len(marked) + len(already_marked) + unknown_count == 1:
+        if marked:
+            return f"{marked[0]}\nAttendance marked"
+        if already_marked:
+            return f"{already_marked[0]}\nAlready marked"
+        return "Unknown Person"
+    lines = []
+    if marked:
+        lines.append(f"{len(marked)} students marked" if len(marked) > 1 else f"{marked[0]} marked")
+    if already_marked:
+        lines.append(f"{len(already_marked)} already marked")
+    if unknown_count:
+        lines.append(f"{unknown_count} unknown")
+    return "\n".join(lines)
+
+def layout(message, cols=LCD_COLS, rows=LCD_ROWS):
+    """Wraps a message into exactly `rows` lines padded to `cols` characters."""
+    lines = []
+    for paragraph in message.split("\n"):
+        lines.extend(utils.wrap_text(paragraph, cols) or [""])
+    lines = [line[:cols] for line in lines[:rows]]
+    return [line.ljust(cols) for line in lines + [""] * (rows - len(lines))]
+
+class FeedbackActor:
+    """Owns the LCD and LEDs: commands are queued and rendered by one task, so feedback never blocks recognition."""
+
+    def __init__(self, lcd=None, gpio=None, hold_seconds=2.0, coalesce_seconds=0.3):
+        self.lcd = lcd
+        self.gpio = gpio
+        self.hold_seconds = hold_seconds # How long a message stays before the welcome screen returns
+        self.coalesce_seconds = coalesce_seconds # Attendance results arriving this close together share one screen
+        self._queue = asyncio.Queue()
+        self._shadow = ["\0" * LCD_COLS for _ in range(LCD_ROWS)] # What the LCD currently shows (unknown at start: rewrite all)
+        self._lcd_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lcd") # Serialized I2C writes off the loop
+        self._patterns = {} # pin -> task running its LED pattern
+        self._revert_at = None
+        self._summary = None # (marked names, already marked names, unknown count) on screen right now
+        self._deferred = None # Command that ended a coalescing window, handled next
+
+    # Commands: all return immediately
+
+    def show(self, message, hold=True):
+        """Displays a message; with hold, the welcome screen returns after hold_seconds."""
+        self._queue.put_nowait(("show", message, hold))
+
+    def welcome(self):
+        self._queue.put_nowait(("welcome",))
+
+    def attendance(self, marked=(), already_marked=(), unknown_count=0):
+        """Reports one batch of attendance results; bursts are merged into one summary."""
+        self._queue.put_nowait(("attendance", list(marked), list(already_marked), unknown_count))
+
+    def led(self, pin, on):
+        """Switches an LED immediately, cancelling any pattern running on it."""
+        self._cancel_pattern(pin)
+        self.gpio.output(pin, self.gpio.HIGH if on else self.gpio.LOW)
+
+    def idle(self, *pins):
+        """Switches LEDs off unless a pattern is still running on them."""
+        for pin in pins:
+            if pin not in self._patterns:
+                self.gpio.output(pin, self.gpio.LOW)
+
+    def blink(self, pin, on_seconds=1.0, times=1, off_seconds=0.2, delay=0.0):
+        """Runs a timed LED pattern without blocking; a new pattern on the same pin replaces the old one."""
+        self._cancel_pattern(pin)
+        self._patterns[pin] = asyncio.create_task(self._blink(pin, on_seconds, times, off_seconds, delay))
+
+    # Actor
+
+    async def run(self):
+        """Processes commands forever."""
+        self._queue.put_nowait(("welcome",))
+        while True:
+            timeout = None if self._revert_at is None else max(0.0, self._revert_at - time.monotonic())
+            try:
+                command, self._deferred = self._deferred, None
+                if command is None:
+                    command = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                self._revert_at = None
+                self._summary = None
+                await self._render(WELCOME_LINES)
+                continue
+            try:
+                await self._handle(command)
+            except Exception as e:
+                print(f"Error updating LCD: {e}")
+
+    async def _handle(self, command):
+        kind = command[0]
+        if kind == "welcome":
+            self._revert_at = None
+            self._summary = None
+            await self._render(WELCOME_LINES)
+        elif kind == "show":
+            _, message, hold = command
+            self._summary = None
+            self._revert_at = time.monotonic() + self.hold_seconds if hold else None
+            await self._render(layout(message))
+        elif kind == "attendance":
+            _, marked, already_marked, unknown_count = command
+            # Collect everything else that arrives within the coalescing window
+            deadline = time.monotonic() + self.coalesce_seconds
+            while True:
+                try:
+                    extra = await asyncio.wait_for(self._queue.get(), max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    break
+                if extra[0] != "attendance":
+                    self._deferred = extra # Keep its place: handled right after this summary
+                    break
+                marked += extra[1]
+                already_marked += extra[2]
+                unknown_count += extra[3]
+            if self._summary is not None: # Still showing a summary: keep counting instead of replacing it
+                marked = self._summary[0] + [name for name in marked if name not in self._summary[0]]
+                already_marked = self._summary[1] + [name for name in already_marked if name not in self._summary[1]]
+                unknown_count += self._summary[2]
+            self._summary = (marked, already_marked, unknown_count)
+            self._revert_at = time.monotonic() + self.hold_seconds
+            await self._render(layout(attendance_summary(marked, already_marked, unknown_count)))
+
+    async def _render(self, lines):
+        """Writes only the characters that differ from what the LCD already shows (no lcd.clear())."""
+        lines = [line.ljust(LCD_COLS)[:LCD_COLS] for line in lines] + [" " * LCD_COLS] * (LCD_ROWS - len(lines))
+        writes = []
+        for row, (old, new) in enumerate(zip(self._shadow, lines)):
+            col = 0
+            while col < LCD_COLS:
+                if old[col] == new[col]:
+                    col += 1
+                    continue
+                start = col
+                while col < LCD_COLS and old[col] != new[col]:
+                    col += 1
+                writes.append((row, start, new[start:col]))
+        self._shadow = lines
+        if writes and self.lcd:
+            await asyncio.get_running_loop().run_in_executor(self._lcd_thread, self._write, writes)
+
+    def _write(self, writes):
+        for row, col, text in writes:
+            self.lcd.cursor_pos = (row, col)
+            self.lcd.write_string(text)
+
+    async def _blink(self, pin, on_seconds, times, off_seconds, delay):
+        try:
+            await asyncio.sleep(delay)
+            for i in range(times):
+                self.gpio.output(pin, self.gpio.HIGH)
+                await asyncio.sleep(on_seconds)
+                self.gpio.output(pin, self.gpio.LOW)
+                if i < times - 1:
+                    await asyncio.sleep(off_seconds)
+        finally:
+            if self._patterns.get(pin) is asyncio.current_task():
+                del self._patterns[pin]
+
+    def _cancel_pattern(self, pin):
+        task = self._patterns.pop(pin, None)
+        if task:
+            task.cancel()
@@ -0,0 +1,125 @@
+import time
+from collections import deque
+import capture_utils
+
+class PiGPIO:
+    """RPi.GPIO in BOARD numbering, with the given pins set up as outputs."""
+
+    def __init__(self, pins):
+        import RPi.GPIO as GPIO # Only importable on a Raspberry Pi
+        self._gpio = GPIO
+        self.HIGH = GPIO.HIGH
+        self.LOW = GPIO.LOW
+        GPIO.setmode(GPIO.BOARD)
+        for pin in pins:
+            GPIO.setup(pin, GPIO.OUT)
+
+    def output(self, pin, value):
+        self._gpio.output(pin, value)
+
+    def cleanup(self):
+        self._gpio.cleanup()
+
+class SimGPIO:
+    """Records LED changes instead of driving pins."""
+
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self, pins, echo=False, history=1000):
+        self.state = {pin: self.LOW for pin in pins}
+        self.events = deque(maxlen=history) # (monotonic time, pin, value), newest last
+        self.echo = echo
+        self.changes = 0
+
+    def output(self, pin, value):
+        if self.state.get(pin) != value:
+            self.changes += 1
+            self.events.append((time.monotonic(), pin, value))
+            if self.echo:
+                print(f"[gpio] pin {pin} {'HIGH' if value else 'LOW'}")
+        self.state[pin] = value
+
+    def cleanup(self):
+        for pin in self.state:
+            self.state[pin] = self.LOW
+
+def create_pi_lcd(cols=20, rows=4, address=0x27):
+    """Initializes the I2C character LCD; returns None if it is not connected."""
+    try:
+        from RPLCD.i2c import CharLCD
+        lcd = CharLCD('PCF8574', address=address, cols=cols, rows=rows)
+        lcd.clear()
+        lcd.write_string("StreakTrack is On")
+        return lcd
+    except Exception as e:
+        print(f"LCD initialization failed: {e}")
+        return None
+
+class SimLCD:
+    """In-memory character display with the part of the CharLCD interface used by FeedbackActor."""
+
+    def __init__(self, cols=20, rows=4, echo=False):
+        self.cols = cols
+        self.rows = rows
+        self.echo = echo
+        self.cursor_pos = (0, 0)
+        self.writes = 0 # write_string calls, one per changed run of characters
+        self.characters = 0 # Characters sent, i.e. what the I2C bus would carry
+        self._screen = [[" "] * cols for _ in range(rows)]
+
+    def write_string(self, text):
+        row, col = self.cursor_pos
+        for char in text:
+            if col < self.cols:
+                self._screen[row][col] = char
+            col += 1
+        self.cursor_pos = (row, min(col, self.cols - 1))
+        self.writes += 1
+        self.characters += len(text)
+        if self.echo:
+            print(f"[lcd] {row}: {''.join(self._screen[row])}")
+
+    def clear(self):
+        self._screen = [[" "] * self.cols for _ in range(self.rows)]
+        self.cursor_pos = (0, 0)
+
+    def lines(self):
+        """Returns what the display currently shows, one string per row."""
+        return ["".join(row) for row in self._screen]
+
+class Hardware:
+    """The LEDs, LCD and cameras the device runs with."""
+
+    def __init__(self, backend, gpio, lcd, cameras):
+        self.backend = backend
+        self.gpio = gpio
+        self.lcd = lcd # None when no display is attached
+        self.cameras = cameras # (name, capture_utils source) pairs, each started by its own CaptureThread
+
+    @property
+    def simulated(self):
+        return self.backend == "sim"
+
+    def summary(self):
+        """Activity counters of the simulated backends (empty on real hardware)."""
+        if not self.simulated:
+            return {}
+        return {"led_changes": self.gpio.changes, "lcd_writes": self.lcd.writes, "lcd_characters": self.lcd.characters}
+
+    def close(self):
+        self.gpio.cleanup()
+
+def create_hardware(config, led_pins):
+    """Builds the backends named by config["hardware_backend"]: "pi" (default) or "sim" for running without a Pi."""
+    backend = config.get("hardware_backend", "pi")
+    if backend not in ("pi", "sim"):
+        raise ValueError(f"Unknown hardware_backend {backend!r}")
+    default_source = "synthetic" if backend == "sim" else "picamera"
+    # One source per entry of config["cameras"], or a single one from the top-level camera_* keys
+    cameras = [(camera["camera_name"], capture_utils.create_source(camera, default=default_source))
+               for camera in capture_utils.camera_configs(config)]
+    if backend == "sim":
+        echo = config.get("sim_echo", False)
+        return Hardware(backend, SimGPIO(led_pins, echo=echo), SimLCD(echo=echo), cameras)
+    return Hardware(backend, PiGPIO(led_pins), create_pi_lcd(), cameras)
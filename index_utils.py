@@ -0,0 +1,379 @@
+import json
+import mmap
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import time
+import numpy as np
+
+ENCODING_SIZE = 128 # face_recognition produces 128-d embeddings
+DEFAULT_THRESHOLD = 0.5 # very similar enough < 0.5 < not similar enough
+
+# students.encoding holds raw little-endian float32 vectors back to back; older databases (user_version 0) hold pickled lists
+ENCODING_FORMAT_VERSION = 2
+
+# Snapshot file: header, then the vectors (64-byte aligned), a uint32 row -> student index, and the student IDs as JSON
+# magic, version, dtype (0 float32, 1 float16), dimensions, rows, vectors offset, IDs offset, IDs length, database size and mtime
+SNAPSHOT_HEADER = struct.Struct("<6sHBxHIQQQQQ")
+SNAPSHOT_MAGIC = b"STEMB\0"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DTYPES = {0: np.dtype("<f4"), 1: np.dtype("<f2")}
+
+def pack_encodings(encodings):
+    """Serializes a student's encodings for the database: float32 bytes, ENCODING_SIZE values per encoding."""
+    if len(encodings) == 0:
+        return b""
+    return np.asarray(encodings, dtype="<f4").reshape(-1, ENCODING_SIZE).tobytes()
+
+def unpack_encodings(blob):
+    """Returns the (n, ENCODING_SIZE) float32 array stored by pack_encodings (a view, no copy)."""
+    return np.frombuffer(blob, dtype="<f4").reshape(-1, ENCODING_SIZE)
+
+def migrate_encodings(db_conn):
+    """Rewrites pickled encodings as packed float32 once; returns the number of rows converted."""
+    if db_conn.execute("PRAGMA user_version").fetchone()[0] >= ENCODING_FORMAT_VERSION:
+        return 0
+    tables = [row[0] for row in db_conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'students'")]
+    rows = db_conn.execute("SELECT student_id, encoding FROM students").fetchall() if tables else []
+    with db_conn:
+        # Our own files from older versions; this is the last time they are unpickled
+        db_conn.executemany("UPDATE students SET encoding = ? WHERE student_id = ?",
+                            [(pack_encodings(pickle.loads(encoding)) if encoding else b"", student_id) for student_id, encoding in rows])
+        db_conn.execute(f"PRAGMA user_version = {ENCODING_FORMAT_VERSION}")
+    if rows:
+        print(f"Migrated {len(rows)} stored students to the packed encoding format.")
+    return len(rows)
+
+def database_stamp(db_path):
+    """Size and modification time of the database, recorded in snapshots to detect that they are stale."""
+    stat = os.stat(db_path)
+    return stat.st_size, stat.st_mtime_ns
+
+def write_snapshot(path, labels, matrix, stamp, dtype="float32"):
+    """Writes the encodings and their student IDs as one memory-mappable file (atomically replaced)."""
+    dtype_code = {"float32": 0, "float16": 1}[dtype]
+    ids = list(dict.fromkeys(labels))
+    id_positions = {student_id: i for i, student_id in enumerate(ids)}
+    row_index = np.fromiter((id_positions[label] for label in labels), dtype="<u4", count=len(labels))
+    vectors = np.ascontiguousarray(matrix, dtype=SNAPSHOT_DTYPES[dtype_code]).tobytes()
+    ids_blob = json.dumps(ids).encode("utf-8")
+    vectors_offset = -(-SNAPSHOT_HEADER.size // 64) * 64 # Aligned so the mapped matrix is SIMD friendly
+    ids_offset = vectors_offset + len(vectors) + row_index.nbytes
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, dtype_code, ENCODING_SIZE, len(labels),
+                                  vectors_offset, ids_offset, len(ids_blob), stamp[0], stamp[1])
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.ljust(vectors_offset, b"\0"))
+        f.write(vectors)
+        f.write(row_index.tobytes())
+        f.write(ids_blob)
+    os.replace(tmp_path, path)
+
+def read_snapshot(path, stamp=None):
+    """Maps a snapshot file; returns (labels, matrix), or None if it is missing, unreadable or not from this database stamp."""
+    try:
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) # Stays alive as long as the arrays viewing it
+    except (OSError, ValueError):
+        return None
+    if len(mapped) < SNAPSHOT_HEADER.size:
+        return None
+    magic, version, dtype_code, dimensions, rows, vectors_offset, ids_offset, ids_length, db_size, db_mtime_ns = SNAPSHOT_HEADER.unpack_from(mapped)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or dimensions != ENCODING_SIZE or dtype_code not in SNAPSHOT_DTYPES:
+        return None
+    if stamp is not None and (db_size, db_mtime_ns) != tuple(stamp):
+        return None
+    if len(mapped) < ids_offset + ids_length:
+        return None # Truncated
+    dtype = SNAPSHOT_DTYPES[dtype_code]
+    matrix = np.frombuffer(mapped, dtype=dtype, count=rows * ENCODING_SIZE, offset=vectors_offset).reshape(rows, ENCODING_SIZE)
+    if dtype != np.float32:
+        matrix = matrix.astype(np.float32) # Half-size file; widened once for the float32 matrix product
+    row_index = np.frombuffer(mapped, dtype="<u4", count=rows, offset=vectors_offset + rows * ENCODING_SIZE * dtype.itemsize)
+    ids = np.empty(0, dtype=object)
+    if ids_length:
+        id_list = json.loads(mapped[ids_offset:ids_offset + ids_length])
+        ids = np.empty(len(id_list), dtype=object)
+        ids[:] = id_list
+    return ids[row_index], matrix
+
+def squared_distances(queries, matrix, sq_norms):
+    """Returns the (queries x rows) squared Euclidean distances."""
+    # |q - k|^2 = |q|^2 + |k|^2 - 2 q.k, computed for every pair with a single matrix product
+    return np.einsum("ij,ij->i", queries, queries)[:, None] + sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+
+def kmeans(matrix, clusters, iterations=10, sample_size=20000, seed=0):
+    """Lloyd's k-means on a random sample of the rows; returns the (clusters x dimensions) centroids."""
+    rng = np.random.default_rng(seed)
+    sample = matrix[rng.choice(len(matrix), min(len(matrix), sample_size), replace=False)] if len(matrix) > sample_size else matrix
+    centroids = sample[rng.choice(len(sample), clusters, replace=False)].copy()
+    sample_norms = np.einsum("ij,ij->i", sample, sample)
+    for _ in range(iterations):
+        assignments = np.argmin(squared_distances(centroids, sample, sample_norms), axis=0)
+        counts = np.bincount(assignments, minlength=clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        filled = counts > 0 # An empty cluster keeps its old centroid
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+class BruteForceSearch:
+    """Exact search: one matrix product against every encoding."""
+
+    kind = "brute"
+
+    def __init__(self, matrix, labels, sq_norms=None):
+        self.matrix = matrix
+        self.labels = labels
+        self.sq_norms = np.einsum("ij,ij->i", matrix, matrix) if sq_norms is None else sq_norms # Cached |k|^2
+
+    def __len__(self):
+        return len(self.labels)
+
+    def search(self, queries):
+        """Returns the label position and distance of the nearest encoding for each query."""
+        sq = squared_distances(queries, self.matrix, self.sq_norms)
+        best = np.argmin(sq, axis=1)
+        return best, np.sqrt(np.maximum(sq[np.arange(len(best)), best], 0.0))
+
+class IVFSearch:
+    """Inverted-file index: encodings are grouped by nearest k-means centroid and only the nprobe closest groups are scanned."""
+
+    kind = "ivf"
+
+    def __init__(self, matrix, labels, nlist=None, nprobe=8, centroids=None, trained_size=None, iterations=10, seed=0):
+        self.nlist = len(centroids) if centroids is not None else max(1, min(len(labels), nlist or int(np.sqrt(len(labels)))))
+        self.nprobe = max(1, min(nprobe, self.nlist))
+        self.centroids = kmeans(matrix, self.nlist, iterations, seed=seed) if centroids is None else centroids
+        self.trained_size = trained_size or len(labels) # Rows the centroids were trained for
+        self._centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        assignments = np.empty(len(labels), dtype=np.int64)
+        for start in range(0, len(labels), 8192): # Chunked so assignment never allocates a rows x nlist matrix at once
+            chunk = matrix[start:start + 8192]
+            assignments[start:start + 8192] = np.argmin(squared_distances(chunk, self.centroids, self._centroid_norms), axis=1)
+        order = np.argsort(assignments, kind="stable")
+        # Rows are stored grouped by list so each probe is one contiguous slice
+        self.matrix = np.ascontiguousarray(matrix[order])
+        self.labels = labels[order]
+        self.sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        self.offsets = np.searchsorted(assignments[order], np.arange(self.nlist + 1))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def search(self, queries):
+        centroid_sq = squared_distances(queries, self.centroids, self._centroid_norms)
+        probes = np.argpartition(centroid_sq, self.nprobe - 1, axis=1)[:, :self.nprobe] if self.nprobe < self.nlist else np.tile(np.arange(self.nlist), (len(queries), 1))
+        best = np.zeros(len(queries), dtype=np.int64)
+        best_sq = np.full(len(queries), np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            # Candidate rows of every probed list, scored with one matrix-vector product
+            candidates = np.concatenate([np.arange(self.offsets[cluster], self.offsets[cluster + 1]) for cluster in probes[i]])
+            if not len(candidates):
+                continue
+            sq = self.sq_norms[candidates] - 2.0 * (self.matrix[candidates] @ query) + query @ query
+            position = int(np.argmin(sq))
+            best_sq[i], best[i] = sq[position], candidates[position]
+        return best, np.sqrt(np.maximum(best_sq, 0.0))
+
+class EmbeddingIndex:
+    """Resident face embedding matrix with a parallel label array, searched exactly or through an IVF index."""
+
+    def __init__(self, db_path="student_faces.db", snapshot_path=None, snapshot_dtype="float32",
+                 index_type="auto", ivf_min_encodings=10000, nlist=None, nprobe=8):
+        self.db_path = db_path
+        self.snapshot_path = snapshot_path or os.path.splitext(db_path)[0] + ".emb"
+        self.snapshot_dtype = snapshot_dtype # "float16" halves the snapshot file (tiny loss of precision)
+        self.index_type = index_type # "brute", "ivf" or "auto" (IVF from ivf_min_encodings encodings on)
+        self.ivf_min_encodings = ivf_min_encodings
+        self.nlist = nlist # IVF lists; None uses sqrt(encodings)
+        self.nprobe = nprobe # IVF lists scanned per query: more is slower but closer to exact
+        self._lock = threading.Lock()
+        self._encodings = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._labels = np.empty(0, dtype=object)
+        self._search = BruteForceSearch(self._encodings, self._labels, self._sq_norms)
+        self._allowed = None # Student IDs matching is restricted to, or None for everyone
+        self._restricted = None # BruteForceSearch over the allowed students' encodings
+        self._generation = 0 # Bumped on every change so a stale background IVF build is discarded
+        self._trained = None # (centroids, rows trained on) of the last IVF build, reused by incremental updates
+
+    def __len__(self):
+        return self._labels.shape[0]
+
+    def student_ids(self):
+        """Returns the set of students with at least one encoding."""
+        with self._lock:
+            return set(self._labels)
+
+    def contents(self):
+        """Returns the current (labels, encodings) arrays, one label per row."""
+        with self._lock:
+            return self._labels, self._encodings
+
+    def search_kind(self):
+        """Returns which search currently answers matches: "brute", "ivf" or "restricted"."""
+        with self._lock:
+            return "restricted" if self._restricted is not None else self._search.kind
+
+    def reload(self):
+        """Reloads every stored encoding and swaps it in atomically, from the snapshot file when it is up to date."""
+        if not os.path.exists(self.db_path):
+            print(f"No embedding database at {self.db_path}; index is empty.")
+            self.load([], [])
+            return 0
+        snapshot = read_snapshot(self.snapshot_path, database_stamp(self.db_path))
+        if snapshot is not None:
+            labels, matrix = snapshot
+            self.load(labels, matrix) # float32 snapshots are used in place, straight from the page cache
+            print(f"Embedding index loaded from snapshot: {len(labels)} encodings.")
+            return len(labels)
+
+        results = []
+        try:
+            db_conn = sqlite3.connect(self.db_path)
+            try:
+                migrate_encodings(db_conn) # Databases written by older versions are converted on first start
+                results = db_conn.execute("SELECT student_id, encoding FROM students").fetchall()
+            finally:
+                db_conn.close()
+        except sqlite3.Error as e:
+            print(f"Error loading face embeddings: {e}")
+
+        labels, matrix = self._unpack_rows(results)
+        self.load(labels, matrix)
+        print(f"Embedding index loaded: {len(labels)} encodings for {len(results)} students.")
+        self.save_snapshot()
+        return len(labels)
+
+    def apply_changes(self, changed_ids, removed_ids):
+        """Updates the index in place after a student sync: re-reads only the changed students from the database."""
+        results = []
+        if changed_ids:
+            db_conn = sqlite3.connect(self.db_path)
+            try:
+                for start in range(0, len(changed_ids), 500): # Stay under SQLite's bound parameter limit
+                    chunk = list(changed_ids[start:start + 500])
+                    results += db_conn.execute(f"SELECT student_id, encoding FROM students WHERE student_id IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            finally:
+                db_conn.close()
+        self.update(list(changed_ids) + list(removed_ids), *self._unpack_rows(results)) # One rebuild for the whole sync
+        print(f"Embedding index updated: {len(changed_ids)} students changed, {len(removed_ids)} removed, {len(self)} encodings.")
+        self.save_snapshot()
+
+    def save_snapshot(self):
+        labels, matrix = self.contents()
+        try:
+            write_snapshot(self.snapshot_path, labels, matrix, database_stamp(self.db_path), self.snapshot_dtype)
+        except OSError as e:
+            print(f"Error writing embedding snapshot: {e}")
+
+    @staticmethod
+    def _unpack_rows(results):
+        labels = []
+        for student_id, encoded_data in results:
+            labels.extend([student_id] * (len(encoded_data or b"") // (ENCODING_SIZE * 4))) # A student can have multiple images
+        return labels, unpack_encodings(b"".join(encoded_data or b"" for _, encoded_data in results))
+
+    def load(self, labels, encodings):
+        """Replaces the index contents with the given labels and encodings."""
+        if len(labels):
+            matrix = np.ascontiguousarray(np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE))
+        else:
+            matrix = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        label_array = np.empty(len(labels), dtype=object)
+        label_array[:] = labels
+        self._install(matrix, label_array)
+
+    def add(self, labels, encodings):
+        """Appends encodings for the given labels (one label per encoding)."""
+        self.update([], labels, encodings)
+
+    def remove(self, student_ids):
+        """Drops every encoding of the given students."""
+        self.update(student_ids, [], [])
+
+    def update(self, removed_ids, labels, encodings):
+        """Drops every encoding of removed_ids and appends the given ones, swapping in the result once."""
+        with self._lock:
+            matrix, current = self._encodings, self._labels
+        keep = ~np.isin(current, list(removed_ids)) if len(removed_ids) else np.ones(len(current), dtype=bool)
+        if keep.all() and not len(labels):
+            return
+        added = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        label_array = np.empty(len(labels), dtype=object)
+        label_array[:] = labels
+        self._install(np.concatenate([matrix[keep], added]), np.concatenate([current[keep], label_array]))
+
+    def restrict(self, student_ids):
+        """Limits matching to the given students (e.g. the current class), or to everyone again with None."""
+        with self._lock:
+            self._allowed = None if student_ids is None else set(student_ids)
+            matrix, labels, sq_norms = self._encodings, self._labels, self._sq_norms
+        restricted = self._restricted_search(matrix, labels, sq_norms, self._allowed)
+        with self._lock:
+            self._restricted = restricted
+
+    @staticmethod
+    def _restricted_search(matrix, labels, sq_norms, allowed):
+        if allowed is None:
+            return None
+        rows = np.flatnonzero(np.isin(labels, list(allowed)))
+        return BruteForceSearch(matrix[rows], labels[rows], sq_norms[rows]) # A class is small: exact search over it is cheapest
+
+    def _use_ivf(self, rows):
+        return self.index_type == "ivf" or (self.index_type == "auto" and rows >= self.ivf_min_encodings)
+
+    def _install(self, matrix, labels):
+        """Swaps in new contents: exact search immediately, the IVF index once built in the background."""
+        sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+        exact = BruteForceSearch(matrix, labels, sq_norms)
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            allowed = self._allowed
+            trained = self._trained
+        restricted = self._restricted_search(matrix, labels, sq_norms, allowed)
+        with self._lock:
+            self._encodings, self._sq_norms, self._labels = matrix, sq_norms, labels
+            self._search, self._restricted = exact, restricted
+        if self._use_ivf(len(labels)) and len(labels):
+            # Keep the trained centroids across syncs until the roster has doubled or halved
+            if trained is not None and not trained[1] / 2 <= len(labels) <= trained[1] * 2:
+                trained = None
+            threading.Thread(target=self._build_ivf, args=(matrix, labels, trained, generation), name="ivf-build", daemon=True).start()
+
+    def _build_ivf(self, matrix, labels, trained, generation):
+        started = time.monotonic()
+        centroids, trained_size = trained or (None, None)
+        try:
+            ivf = IVFSearch(matrix, labels, nlist=self.nlist, nprobe=self.nprobe, centroids=centroids, trained_size=trained_size)
+        except Exception as e:
+            print(f"Error building IVF index, using exact search: {e}")
+            return
+        with self._lock:
+            if generation != self._generation:
+                return # Contents changed meanwhile; the newer build wins
+            self._search = ivf
+            self._trained = (ivf.centroids, ivf.trained_size)
+        print(f"IVF index ready: {ivf.nlist} lists, nprobe {ivf.nprobe}, {len(labels)} encodings in {time.monotonic() - started:.2f}s.")
+
+    def match(self, face_encodings, threshold=DEFAULT_THRESHOLD):
+        """Matches each face encoding against the known encodings; returns a list of (student_id, distance)."""
+        if len(face_encodings) == 0:
+            return []
+        with self._lock:
+            search = self._restricted if self._restricted is not None else self._search
+        if len(search) == 0:
+            return [("Unknown", float("inf")) for _ in range(len(face_encodings))]
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        best, best_dist = search.search(queries)
+        matches = []
+        for idx, distance in zip(best, best_dist):
+            if distance < threshold:
+                matches.append((search.labels[idx], float(distance)))
+            else:
+                matches.append(("Unknown", float(distance)))
+        return matches
@@ -1,42 +1,78 @@
+import time
+BOOT_STARTED = time.monotonic() # Taken before the other imports so startup metrics include them
 import asyncio
-import websockets
+import functools
 import json
-import cv2
-import RPi.GPIO as GPIO
 from datetime import datetime
-from picamera2 import Picamera2, Preview
-import numpy as np
 import utils
-import sqlite3
-import face_recognition
-import pickle
-import os
-import face_utils
+import face_utils # face_recognition/dlib are imported lazily, by the recognition workers
 import stream_utils
+from collections import deque
+from pool_utils import RecognitionExecutor
+from motion_utils import MotionGate, AdaptiveScheduler
+from track_utils import FaceTracker
+import hardware_utils
+from capture_utils import CaptureThread, camera_configs
+from attendance_utils import AttendanceStore
+from feedback_utils import FeedbackActor
+from metrics_utils import MetricsRegistry, serve_metrics
+from ws_utils import ConnectionManager, PRIORITY_ATTENDANCE, PRIORITY_DETECTED
 
-# GPIO Setup
+# LED pins (BOARD numbering)
 GREEN_LED_PIN = 32
 YELLOW_LED_PIN = 36
 BLUE_LED_PIN = 38
 RED_LED_PIN = 40
-
-GPIO.setmode(GPIO.BOARD)
-GPIO.setup(GREEN_LED_PIN, GPIO.OUT)
-GPIO.setup(YELLOW_LED_PIN, GPIO.OUT)
-GPIO.setup(BLUE_LED_PIN, GPIO.OUT)
-GPIO.setup(RED_LED_PIN, GPIO.OUT)
+LED_PINS = (GREEN_LED_PIN, YELLOW_LED_PIN, BLUE_LED_PIN, RED_LED_PIN)
 
 # Global Variables
-website_websocket = None
+hardware = None # GPIO, LCD and camera backends chosen by config["hardware_backend"]
+connection = None # ConnectionManager owning the server websocket
+feedback = None # FeedbackActor owning the LCD and LEDs
 students = []
-attendance_marked = {}
+attendance_store = None # Durable attendance log and outbox of unsent events
+outbox_ready = asyncio.Event() # Wakes the outbox drainer when there may be attendance events to send
+sync_lock = asyncio.Lock() # One student sync at a time
 streaming_active = False
+streaming_camera = 0 # Index in cameras of the camera being streamed
 face_detected = False
-frame_queue = asyncio.Queue(maxsize=10) # Create a queue for frame storage
-latest_frame = None
+cameras = [] # One CameraPipeline per configured camera
+recognition_executor = None # Worker pool shared by every camera
+
+# Metrics (served on metrics_port in the Prometheus format and reported to the server)
+metrics = MetricsRegistry()
+stage_latency = {stage: metrics.histogram("streaktrack_stage_seconds", "Recognition stage latency in seconds.", {"stage": stage})
+                 for stage in ("detect", "encode", "match")}
+recognition_latency = metrics.histogram("streaktrack_recognition_latency_seconds", "Seconds from frame capture to its recognition result.")
+send_latency = metrics.histogram("streaktrack_ws_send_seconds", "WebSocket send latency in seconds.")
+recognitions = {result: metrics.counter("streaktrack_recognitions_total", "Faces identified, by result.", {"result": result})
+                for result in ("known", "unknown")}
+attendance_marked = metrics.counter("streaktrack_attendance_marked_total", "Attendance records written.")
+startup_stages = {} # Boot stage -> seconds since the process started
+
+class CameraPipeline:
+    """One camera's capture thread and frame ring, with the motion gate, scheduler and tracker that follow its frames."""
+
+    def __init__(self, index, name, capture_thread, scheduler, tracker, motion_gate=None):
+        self.index = index # Recognition queue and stream header source of this camera
+        self.name = name
+        self.capture_thread = capture_thread
+        self.ring = capture_thread.ring
+        self.scheduler = scheduler
+        self.tracker = tracker
+        self.motion_gate = motion_gate
+
+def mark_startup(stage):
+    """Records when a boot stage first completed, as a metric and in the log."""
+    if stage in startup_stages:
+        return
+    startup_stages[stage] = time.monotonic() - BOOT_STARTED
+    metrics.gauge("streaktrack_startup_seconds", "Seconds from process start until each boot stage completed.", {"stage": stage}).set(round(startup_stages[stage], 3))
+    print(f"Startup: {stage} after {startup_stages[stage]:.2f}s")
 
 # Config File
 CONFIG_FILE = "config.json"
+STUDENTS_FILE = "students.json" # Last roster received from the server
 
 def load_config():
     """Loads configuration from config.json with error handling."""
@@ -56,233 +92,495 @@ def load_config():
         print(f"Error loading config: {e}")
         return None
 
-async def connect_websocket():
-    """Connects to the WebSocket server with error handling."""
-    global website_websocket, students
-    config = load_config()
-    if not config:
-        return
-
+def build_uri(config):
+    """Builds the StreakTrack WebSocket URI from the configuration."""
     website_url = config.get("website_url")
     dev_id = config.get("deviceId")
     org_id = config.get("organizationId")
     if not all([website_url, dev_id, org_id]):
         print("Error: Incomplete configuration in config.json.")
-        return
+        return None
+    return f"{website_url}/api/ws?deviceId={dev_id}&organizationId={org_id}&isHardware=true"
 
-    uri = f"{website_url}/api/ws?deviceId={dev_id}&organizationId={org_id}&isHardware=true"
+async def on_connected():
+    """Runs after every successful (re)connect: status feedback and replay of the attendance outbox."""
+    feedback.led(BLUE_LED_PIN, True)
+    feedback.led(RED_LED_PIN, False)
+    print("Connected to StreakTrack")
+    mark_startup("connected")
+    attendance_store.in_flight.clear() # Unacknowledged events are sent again on the new connection
+    feedback.show("Connected")
+    outbox_ready.set() # Replay attendance marked while the device was offline
 
+async def on_disconnected():
+    """Runs after a lost or failed connection; the connection manager keeps retrying."""
+    feedback.led(RED_LED_PIN, True)
+    feedback.led(BLUE_LED_PIN, False)
+
+async def fetch_students(student_list):
+    """Syncs the stored encodings with the student data received from the server and reloads the matcher."""
+    global students
     try:
-        website_websocket = await websockets.connect(uri)
-        GPIO.output(BLUE_LED_PIN, GPIO.HIGH)
-        print("Connected to StreakTrack")
-        attendance_marked = {}
-        utils.save_json("attendance.json", {})
-        return True #connection successful
-    except websockets.exceptions.ConnectionRefusedError:
-        print("Error: Connection refused by server. Check URL or server status.")
-        GPIO.output(RED_LED_PIN, GPIO.HIGH)
-        GPIO.output(BLUE_LED_PIN, GPIO.LOW)
-        return False
-    except websockets.exceptions.InvalidURI:
-        print("Error: Invalid WebSocket URI in config.json.")
-        GPIO.output(RED_LED_PIN, GPIO.HIGH)
-        GPIO.output(BLUE_LED_PIN, GPIO.LOW)
-        return False
+        async with sync_lock: # A newer roster waits for the running sync instead of racing it
+            students = student_list
+            utils.save_json(STUDENTS_FILE, students) # Names stay available when the device restarts offline
+            config = load_config() or {}
+            # Encode only new or changed students; the old database stays live until the sync completes
+            changed_ids, removed_ids = await face_utils.encode_and_store_students(
+                students,
+                download_concurrency=config.get("enrollment_download_concurrency", 8),
+                workers=config.get("enrollment_workers"),
+                batch_size=config.get("enrollment_batch_size", 50),
+                # Encode on the warm recognition workers unless a separate pool is configured: a second pool
+                # would load another copy of dlib (~100 MB) per process for the length of the sync
+                executor=None if config.get("enrollment_workers") else recognition_executor,
+            )
+            face_utils.update_embeddings(changed_ids, removed_ids) # Only the changed students are swapped in the matcher
+            print("Student data fetched, encoded, and stored.")
+            feedback.show("Students\nreceived")
     except Exception as e:
-        print(f"Error connecting to StreakTrack: {e}")
-        GPIO.output(RED_LED_PIN, GPIO.HIGH)
-        GPIO.output(BLUE_LED_PIN, GPIO.LOW)
-        return False
-
-async def fetch_students():
-    """Fetches student data from the server, encodes images, and saves it with error handling."""
-    global students, website_websocket
+        print(f"Error fetching student data: {e}")
+
+def student_payload(student_id, device_id, timestamp, camera=None):
+    """Builds the student object sent with attendance and detected events."""
+    payload = {
+        "name": face_utils.get_student_name(student_id, students),
+        "enrollmentNo": face_utils.get_enrollment_no(student_id, students),
+        "deviceId": device_id,
+        "studentId": student_id,
+        "timestamp": utils.format_timestamp(timestamp)
+    }
+    if camera is not None:
+        payload["camera"] = camera # Only sent by devices with more than one camera
+    return payload
+
+async def drain_outbox():
+    """Sends queued attendance events in order, in batches, until the outbox is empty or the connection drops."""
+    if not connection or not connection.is_connected():
+        print(f"WebSocket connection not established. {attendance_store.pending_count()} attendance event(s) queued for later.")
+        return
     try:
-        if website_websocket:
-            if os.path.exists('student_faces.db'):
-                os.remove('student_faces.db')
-                print("Old student_faces.db deleted.")
-            response = await website_websocket.recv()
-            data = json.loads(response)
-            if "students" in data:
-                students = data["students"]
-                await face_utils.encode_and_store_students(students) #Encode images and store in the database.
-                print("Student data fetched, encoded, and stored.")
-                utils.lcd_display("Students\nreceived")
-                await asyncio.sleep(2)
-                utils.lcd_welcome()
+        while True:
+            pending = attendance_store.pending(attendance_store.batch_size)
+            if not pending:
+                return
+            # The connection manager coalesces these into batch frames ahead of detected events and stream frames
+            deliveries = [await connection.send(dict(message, eventId=outbox_id), PRIORITY_ATTENDANCE) for outbox_id, message in pending]
+            results = await asyncio.gather(*deliveries, return_exceptions=True)
+            # Record what did go out even if a later message failed, so it is not sent a second time
+            outbox_ids = [outbox_id for (outbox_id, _), result in zip(pending, results) if not isinstance(result, BaseException)]
+            if attendance_store.require_ack:
+                attendance_store.in_flight.update(outbox_ids) # Removed from the outbox when the server sends an ack
             else:
-                print("Error: No student data received from server.")
-        else:
-            print("Error: WebSocket connection not established.")
-    except websockets.exceptions.ConnectionClosed:
-        print("Error: WebSocket connection closed while fetching students.")
-    except json.JSONDecodeError:
-        print("Error: Invalid JSON received from server.")
-    except Exception as e:
-        print(f"Error fetching student data: {e}")
+                attendance_store.ack(outbox_ids)
+            if len(outbox_ids) < len(pending):
+                raise ConnectionError("attendance events were not delivered")
+    except ConnectionError:
+        print(f"WebSocket connection closed. {attendance_store.pending_count()} attendance event(s) kept in the outbox.")
 
-async def mark_attendance(recognized_student_id):
-    """Marks attendance and sends data to the server with error handling."""
-    global attendance_marked, website_websocket
+async def outbox_drainer():
+    """The only task that drains the outbox, so marking attendance never waits on the network."""
+    while True:
+        await outbox_ready.wait()
+        outbox_ready.clear() # Events marked while this drain runs set it again and get their own pass
+        try:
+            await drain_outbox()
+        except Exception as e:
+            print(f"Error sending attendance: {e}")
+
+async def mark_attendance(recognized_student_ids, camera=None):
+    """Marks attendance for every student recognized in one frame with a single write, message and LCD update."""
     try:
-        student_name = face_utils.get_student_name(recognized_student_id, students)
-        enrollment_no = face_utils.get_enrollment_no(recognized_student_id, students)
         device_id = load_config().get("deviceId")
-
         timestamp = datetime.now()
+        unknown_count = sum(1 for student_id in recognized_student_ids if student_id == "Unknown")
+
+        marked = []
+        already_marked = []
+        attendance_messages = []
+        detected_messages = []
+        for recognized_student_id in dict.fromkeys(recognized_student_ids): # Unique, in detection order
+            if recognized_student_id == "Unknown":
+                continue
+            student_data = student_payload(recognized_student_id, device_id, timestamp, camera)
+            # Every camera checks the same store, and nothing awaits between this check and the write below,
+            # so a student seen by two cameras at once is still marked only once
+            if not attendance_store.is_marked(recognized_student_id, timestamp):
+                marked.append(student_data)
+                attendance_messages.append({"type": "attendance", "student": student_data})
+                print(f"Attendance marked for student ID: {recognized_student_id}")
+            else:
+                already_marked.append(student_data)
+                # Send detected event even if attendance was already marked
+                detected_messages.append({"type": "detected", "student": student_data})
+                print(f"Attendance already marked for student ID: {recognized_student_id}")
 
-        if recognized_student_id not in attendance_marked:
-            attendance_marked[recognized_student_id] = timestamp.isoformat()  # Save ISO format
+        if marked:
+            # One journal transaction for the whole frame; the messages wait in the outbox until delivered
+            new_ids = attendance_store.mark([student["studentId"] for student in marked], timestamp, attendance_messages)
+            attendance_marked.inc(len(new_ids))
 
-            student_data = {
-                "name": student_name,
-                "enrollmentNo": enrollment_no,
-                "deviceId": device_id,
-                "studentId": recognized_student_id,
-                "timestamp": utils.format_timestamp(timestamp)
-            }
+        # Feedback is queued to the UI actor, which merges bursts into one summary; nothing here waits on it
+        feedback.attendance([student["name"] for student in marked], [student["name"] for student in already_marked], unknown_count)
+        if unknown_count:
+            feedback.led(RED_LED_PIN, True)
+        if marked or already_marked:
+            feedback.blink(GREEN_LED_PIN, 1)
+        if already_marked:
+            feedback.blink(YELLOW_LED_PIN, 1, delay=1)
 
-            if website_websocket:
-                await website_websocket.send(json.dumps({"type": "attendance", "student": student_data}))
-            else:
-                print("Error: WebSocket connection not established. Attendance data not sent.")
-
-            utils.save_json("attendance.json", attendance_marked)
-            print(f"Attendance marked for student ID: {recognized_student_id}")
-            utils.lcd_display(f"{student_name}\nAttendance marked")
-            await asyncio.sleep(2)
-            utils.lcd_welcome()
-            utils.blink_led(GREEN_LED_PIN, 1)
-        else:
-            print(f"Attendance already marked for student ID: {recognized_student_id}")
-            utils.lcd_display(f"{student_name}\nAlready marked")
-            await asyncio.sleep(2)
-            utils.lcd_welcome()
-            utils.blink_led(GREEN_LED_PIN, 1)
-            utils.blink_led(YELLOW_LED_PIN, 1)
-
-            # Send detected event even if attendance was already marked
-            student_data = {
-                "name": student_name,
-                "enrollmentNo": enrollment_no,
-                "deviceId": device_id,
-                "studentId": recognized_student_id,
-                "timestamp": utils.format_timestamp(timestamp)
-            }
-            if website_websocket:
-                await website_websocket.send(json.dumps({"type": "detected", "student": student_data}))
-            else:
-                print("Error: WebSocket connection not established. Detected data not sent.")
+        # Sending happens in the background: the drainer picks up the outbox, and detected events are only
+        # offered to the sender (they are ephemeral, so they are dropped while offline or when the queue is full)
+        if marked:
+            outbox_ready.set()
+        if connection and connection.is_connected():
+            for message in detected_messages:
+                connection.offer(message, PRIORITY_DETECTED)
 
     except Exception as e:
         print(f"Error marking attendance: {e}")
-        utils.lcd_display("Error")
-        await asyncio.sleep(2)
-        utils.lcd_welcome()
+        feedback.show("Error")
 
-async def capture_frame(picam2):
-    """Capture frames continuously and push them into the queue."""
-    global latest_frame
+async def streaming_loop(controller, mode="json"):
+    """Stream the newest frame at the rate, quality and resolution chosen by the adaptive controller."""
+    loop = asyncio.get_running_loop()
+    sequence = 0
+    last_sequence = 0
+    camera = None
     while True:
-        frame = picam2.capture_array()
-        latest_frame = frame.copy()  # Clone to prevent conflict
-        if frame_queue.full():
-            await frame_queue.get()
-        await frame_queue.put(frame)  # Still allow queue for streaming
-        await asyncio.sleep(0)
-
-async def streaming_loop():
-    """Continuously stream frames."""
+        if streaming_active and connection.is_connected():
+            if camera is not cameras[streaming_camera]:
+                camera, last_sequence = cameras[streaming_camera], 0 # Switched cameras: every ring counts from its own start
+            frame_ref = camera.ring.acquire(last_sequence) # Borrowed view of the newest slot, no copy
+            if frame_ref is not None:
+                last_sequence = frame_ref.sequence
+                try:
+                    # JPEG (and base64) encoding run in a thread so the event loop keeps serving attendance
+                    if mode == "binary":
+                        jpeg, width, height = await loop.run_in_executor(None, stream_utils.encode_jpeg, frame_ref.frame, controller.quality, controller.scale)
+                        payload = stream_utils.pack_frame(jpeg, sequence, width, height, controller.quality, source=camera.index,
+                                                          timestamp=frame_ref.captured_at)
+                    else:
+                        frame_base64 = await loop.run_in_executor(None, stream_utils.encode_frame, frame_ref.frame, controller.quality, controller.scale)
+                        payload = json.dumps({"type": "live_stream", "frame": frame_base64, "camera": camera.name})
+                finally:
+                    frame_ref.release()
+                sequence += 1
+                await asyncio.sleep(controller.bandwidth_delay(len(payload)))
+                # Stream frames have the lowest priority; the sender only takes one when no attendance is waiting
+                delivery = connection.offer_frame(payload)
+                await asyncio.wait([delivery])
+                if not delivery.cancelled() and delivery.exception() is None: # Not replaced by a newer frame or lost with the connection
+                    controller.record_send(delivery.result(), stream_utils.write_buffer_size(connection.websocket))
+        await asyncio.sleep(controller.frame_interval())
+
+async def handle_recognitions(matches, camera=None):
+    """Updates LEDs/LCD and marks attendance for the (student_id, distance, box) matches of one frame."""
+    if matches:
+        feedback.led(YELLOW_LED_PIN, True)
+        await mark_attendance([student_id for student_id, _, _ in matches], camera)
+    else:
+        feedback.idle(YELLOW_LED_PIN, GREEN_LED_PIN, RED_LED_PIN) # Leaves running blink patterns alone
+
+async def identify_tracks(tracker, frame, face_locations, padding=0.25):
+    """Updates the tracker with one frame's faces and encodes/matches only the tracks that need it."""
+    tracks = tracker.update(face_locations)
+    # Only new tracks and tracks due for re-verification are encoded and matched
+    to_identify = [track for track in tracks if tracker.needs_identity(track)]
+    if not to_identify:
+        return []
+    started = time.monotonic()
+    crops = face_utils.crop_faces(frame, [track.box for track in to_identify], padding)
+    face_encodings = await recognition_executor.run(face_utils.encode_crops, crops)
+    encoded = time.monotonic()
+    identities = face_utils.match_encodings(face_encodings)
+    stage_latency["encode"].observe(encoded - started)
+    stage_latency["match"].observe(time.monotonic() - encoded)
+    matches = []
+    for track, (student_id, distance) in zip(to_identify, identities):
+        recognitions["unknown" if student_id == "Unknown" else "known"].inc()
+        if tracker.assign(track, student_id, distance): # One event per appearance (or identity change)
+            matches.append((student_id, distance, track.box))
+    return matches
+
+async def face_recognition_loop(camera, padding=0.25):
+    """Detect faces in one camera's latest frame when the scene changes and recognize each tracked face once per appearance."""
+    scheduler, tracker, motion_gate = camera.scheduler, camera.tracker, camera.motion_gate
+    camera_name = camera.name if len(cameras) > 1 else None # Attendance events name the camera on multi-camera devices
+    pending = deque() # (frame ref, future) pairs for frames currently being detected by the workers
+    last_sequence = 0
+    next_tick = time.monotonic()
     while True:
-        if streaming_active and not frame_queue.empty():
-            frame = await frame_queue.get()
-            frame_base64 = stream_utils.encode_frame(frame)
+        if time.monotonic() >= next_tick:
+            next_tick = time.monotonic() + scheduler.interval() # New frames go in on the scheduler's own clock
+            frame_ref = camera.ring.acquire(last_sequence) # Borrowed view of the newest slot, held until its crops are cut
+            if frame_ref is not None:
+                last_sequence = frame_ref.sequence
+                # The motion gate is cheap; full detection only runs while the scheduler is in its active window
+                if motion_gate is None or motion_gate.update(frame_ref.frame):
+                    scheduler.mark_active()
+                if scheduler.is_active():
+                    # Each camera has its own queue in the shared pool, served in turn with the others
+                    future = recognition_executor.submit(frame_ref.frame, source=camera.index)
+                    # A frame dropped by backpressure goes back to the ring at once, not when it reaches the head of pending
+                    future.add_done_callback(lambda future, frame_ref=frame_ref: future.cancelled() and frame_ref.release())
+                    pending.append((frame_ref, future))
+                else:
+                    frame_ref.release()
+        while pending and pending[0][1].done():
+            frame_ref, future = pending.popleft()
             try:
-                await website_websocket.send(json.dumps({
-                    "type": "live_stream",
-                    "frame": frame_base64
-                }))
-            except websockets.exceptions.ConnectionClosed:
-                print("WebSocket connection closed while streaming.")
-                break
+                if future.cancelled():
+                    continue # Dropped by backpressure in favour of a newer frame; already released
+                face_locations = future.result()
+                mark_startup("first_recognition") # The first frame made it through a warm detector
+                if not face_locations:
+                    await handle_recognitions([], camera_name)
+                    continue
+                scheduler.mark_active() # Keep polling at full rate while someone is in front of the camera
+                matches = await identify_tracks(tracker, frame_ref.frame, face_locations, padding)
+                recognition_latency.observe(time.monotonic() - frame_ref.timestamp) # Includes queueing behind other frames
             except Exception as e:
-                print(f"Error sending stream frame: {e}")
-        await asyncio.sleep(0)  # Run as fast as possible
-
-async def face_recognition_loop():
-    """Run face recognition continuously with a delay of 0.5 seconds."""
-    global face_detected
-    global latest_frame
-    processing_face = False
+                print(f"Error recognizing face: {e}")
+                continue
+            finally:
+                frame_ref.release()
+            if matches:
+                await handle_recognitions(matches, camera_name) # Every face of the frame is handled in one pass
+        timeout = max(0.0, next_tick - time.monotonic())
+        if pending:
+            await asyncio.wait({pending[0][1]}, timeout=timeout) # Wake as soon as the oldest detection finishes
+        else:
+            await asyncio.sleep(timeout)
+
+async def warm_up_models():
+    """Starts every recognition worker and warms its models in the background, then shows the welcome screen."""
+    try:
+        await recognition_executor.warm_up(face_utils.warm_up) # Each worker already warmed up in its initializer; this call is cheap
+    except Exception as e:
+        print(f"Model warm-up failed: {e}")
+    mark_startup("models")
+    feedback.welcome()
+
+def register_metric_sources(stream_controller):
+    """Exposes the counters the components already keep; they are only read when metrics are collected."""
+    for camera in cameras:
+        labels = {"camera": camera.name}
+        metrics.counter("streaktrack_capture_frames_total", "Frames captured.", labels, fn=lambda camera=camera: camera.capture_thread.frames)
+        metrics.gauge("streaktrack_capture_fps", "Frames captured per second.", labels, fn=lambda camera=camera: camera.capture_thread.fps)
+        metrics.counter("streaktrack_capture_dropped_total", "Frames dropped by the capture ring.", dict(labels, reason="unread"), fn=lambda camera=camera: camera.ring.unread_dropped)
+        metrics.counter("streaktrack_capture_dropped_total", "Frames dropped by the capture ring.", dict(labels, reason="ring_full"), fn=lambda camera=camera: camera.ring.full_dropped)
+        metrics.gauge("streaktrack_recognition_queue_depth", "Frames waiting for a recognition worker.", labels,
+                      fn=lambda camera=camera: recognition_executor.queue_depth(camera.index))
+    metrics.counter("streaktrack_recognition_submitted_total", "Frames submitted for detection.", fn=lambda: recognition_executor.submitted)
+    metrics.counter("streaktrack_recognition_dropped_total", "Frames dropped by recognition backpressure.", fn=lambda: recognition_executor.dropped)
+    metrics.gauge("streaktrack_ws_connected", "1 while connected to the server.", fn=lambda: int(connection.is_connected()))
+    metrics.counter("streaktrack_ws_messages_sent_total", "WebSocket messages sent.", fn=lambda: connection.frames_sent)
+    metrics.counter("streaktrack_ws_bytes_sent_total", "WebSocket bytes sent.", fn=lambda: connection.bytes_sent)
+    metrics.counter("streaktrack_ws_reconnects_total", "Lost server connections.", fn=lambda: connection.reconnects)
+    metrics.gauge("streaktrack_ws_queue_depth", "Messages waiting to be sent.", fn=connection.queue_depth)
+    metrics.gauge("streaktrack_ws_heartbeat_seconds", "Last heartbeat round trip.", fn=lambda: connection.latency or 0.0)
+    metrics.gauge("streaktrack_stream_fps", "Current live-stream frame rate.", fn=lambda: stream_controller.fps)
+    metrics.gauge("streaktrack_stream_quality", "Current live-stream JPEG quality.", fn=lambda: stream_controller.quality)
+    metrics.gauge("streaktrack_outbox_pending", "Attendance events not yet delivered.", fn=attendance_store.pending_count)
+    metrics.gauge("streaktrack_embeddings", "Face encodings in the matcher.", fn=lambda: len(face_utils.embedding_index))
+    for field in ("images", "downloaded", "download_failed", "encoded", "encode_failed", "stored"):
+        metrics.gauge("streaktrack_enrollment_progress", "Counters of the running or last student sync.", {"stage": field},
+                      fn=lambda field=field: getattr(face_utils.enrollment_pipeline.progress, field))
+    metrics.gauge("streaktrack_enrollment_images_per_second", "Encoding rate of the running or last student sync.",
+                  fn=lambda: face_utils.enrollment_pipeline.progress.images_per_second())
+
+async def metrics_loop(interval):
+    """Reports a metrics snapshot to the server every interval seconds while connected."""
+    device_id = (load_config() or {}).get("deviceId")
     while True:
-        if latest_frame is not None and not processing_face:
-            frame = latest_frame.copy()
-            recognized_student_id = face_utils.recognize_face(frame)
-            if recognized_student_id is not None:
-                processing_face = True
-                GPIO.output(YELLOW_LED_PIN, GPIO.HIGH)
-                GPIO.output(GREEN_LED_PIN, GPIO.LOW)
-                utils.lcd_display("Please Wait...")
-                if recognized_student_id == "Unknown":
-                    utils.lcd_display("Unknown Person")
-                    GPIO.output(RED_LED_PIN, GPIO.HIGH)
-                    await asyncio.sleep(1)
-                    utils.lcd_welcome()
-                else:
-                    await mark_attendance(recognized_student_id)
-                processing_face = False
-            else:
-                GPIO.output(YELLOW_LED_PIN, GPIO.LOW)
-                GPIO.output(GREEN_LED_PIN, GPIO.LOW)
-                GPIO.output(RED_LED_PIN, GPIO.LOW)
-        await asyncio.sleep(0.5)
-
-async def websocket_message_handler():
-    """Handles incoming WebSocket messages with error handling."""
-    global streaming_active
-    while website_websocket:
-        try:
-            message = await website_websocket.recv()
-            data = json.loads(message)
-            if data.get("type") == "start_stream":
-                streaming_active = True
-                print("Streaming started.")
-            elif data.get("type") == "stop_stream":
-                streaming_active = False
-                print("Streaming stopped.")
-        except websockets.exceptions.ConnectionClosed:
-            print("WebSocket connection closed.")
-            break
-        except json.JSONDecodeError:
-            print("Received invalid JSON message.")
-        except Exception as e:
-            print(f"Error handling WebSocket message: {e}")
+        await asyncio.sleep(interval)
+        if connection.is_connected():
+            await connection.send({"type": "metrics", "deviceId": device_id, "metrics": metrics.snapshot()}, PRIORITY_DETECTED)
+
+def find_camera(camera):
+    """Returns the index of a camera given by name or index, or None if there is no such camera."""
+    for pipeline in cameras:
+        if camera in (pipeline.name, pipeline.index):
+            return pipeline.index
+    return None
+
+async def websocket_message_handler(data):
+    """Handles one incoming WebSocket message."""
+    global streaming_active, streaming_camera
+    if "students" in data:
+        asyncio.create_task(fetch_students(data["students"])) # Sync in the background; recognition keeps running
+    elif data.get("type") == "start_stream":
+        if data.get("camera") is not None: # Without a camera field the last streamed (initially the first) camera is used
+            index = find_camera(data["camera"])
+            if index is None:
+                print(f"Unknown camera {data['camera']!r}; streaming not started.")
+                return
+            streaming_camera = index
+        streaming_active = True
+        print(f"Streaming started from {cameras[streaming_camera].name}.")
+    elif data.get("type") == "stop_stream":
+        streaming_active = False
+        print("Streaming stopped.")
+    elif data.get("type") == "class_roster":
+        face_utils.restrict_matching(data.get("studentIds")) # null matches the whole organization again
+        print(f"Matching restricted to {len(data['studentIds'])} students." if data.get("studentIds") is not None else "Matching every student.")
+    elif data.get("type") == "ack":
+        attendance_store.ack(data.get("eventIds", [])) # Server confirmed these attendance events
 
 async def main():
     """Main function to start the application."""
+    global recognition_executor, attendance_store, connection, students, feedback, hardware
+    config = load_config() or {}
+    metrics_runner = None
     try:
-        GPIO.output(RED_LED_PIN, GPIO.HIGH)
-        if await connect_websocket():
-            utils.lcd_display("Connected")
-            await asyncio.sleep(2)
-            utils.lcd_welcome()
-            await fetch_students()
-            asyncio.create_task(websocket_message_handler())
-
-            picam2 = face_utils.setup_camera(width=640, height=480)
-            asyncio.create_task(capture_frame(picam2))
-            asyncio.create_task(streaming_loop())
-            asyncio.create_task(face_recognition_loop())
-
-            while True:
-                await asyncio.sleep(1)
-        GPIO.output(RED_LED_PIN, GPIO.LOW)
+        # Real Pi peripherals, or recording stand-ins and a file/synthetic camera for running on any machine
+        hardware = hardware_utils.create_hardware(config, LED_PINS)
+        # LCD and LED feedback runs as its own actor so it never throttles recognition
+        feedback = FeedbackActor(
+            hardware.lcd,
+            hardware.gpio,
+            hold_seconds=config.get("lcd_hold_seconds", 2.0),
+            coalesce_seconds=config.get("lcd_coalesce_seconds", 0.3),
+        )
+        asyncio.create_task(feedback.run())
+        feedback.led(RED_LED_PIN, True)
+        feedback.show("Starting...", hold=False) # Replaced by the welcome screen once the face models are warm
+        mark_startup("hardware")
+        attendance_store = AttendanceStore(
+            config.get("attendance_db", "attendance.db"),
+            batch_size=config.get("outbox_batch_size", 50),
+            require_ack=config.get("outbox_require_ack", False),
+        )
+        face_utils.MATCH_THRESHOLD = config.get("match_threshold", face_utils.MATCH_THRESHOLD) # Pick it from a benchmark.py sweep
+        embedding_index = face_utils.embedding_index
+        embedding_index.snapshot_dtype = config.get("embedding_snapshot_dtype", "float32")
+        # Exact search for small rosters, an IVF index (built in the background) for large ones
+        embedding_index.index_type = config.get("index_type", "auto")
+        embedding_index.ivf_min_encodings = config.get("index_ivf_min_encodings", 10000)
+        embedding_index.nlist = config.get("index_nlist")
+        embedding_index.nprobe = config.get("index_nprobe", 8)
+        embedding_index.restrict(config.get("class_roster")) # Optional fixed list of the students expected at this device
+        face_utils.reload_embeddings() # Load whatever encodings are already stored locally
+        students = utils.load_json(STUDENTS_FILE) or [] # Roster from the last sync, until the server sends a fresh one
+        mark_startup("embeddings")
+        uri = build_uri(config)
+        if not uri:
+            return
+        # Reconnects with backoff forever; recognition below runs from the local stores whether or not it is connected
+        connection = ConnectionManager(
+            uri,
+            on_message=websocket_message_handler,
+            on_connect=on_connected,
+            on_disconnect=on_disconnected,
+            min_backoff=config.get("reconnect_min_backoff", 1.0),
+            max_backoff=config.get("reconnect_max_backoff", 60.0),
+            heartbeat_interval=config.get("heartbeat_interval", 15.0),
+            batch_max=config.get("send_batch_max", 50),
+            observe_latency=send_latency.observe,
+        )
+        asyncio.create_task(connection.run())
+        asyncio.create_task(outbox_drainer())
+
+        # Detection and encoding run on a worker pool so the event loop never blocks on dlib
+        recognition_executor = RecognitionExecutor(
+            functools.partial(
+                face_utils.detect_faces,
+                detection_width=config.get("detection_width", 320),
+                upsample=config.get("detection_upsample", 1),
+            ),
+            workers=config.get("recognition_workers"), # Defaults to one worker per CPU core
+            mode=config.get("recognition_mode", "process"), # "process" or "thread"
+            queue_size=config.get("recognition_queue_size", 2),
+            observe_latency=stage_latency["detect"].observe,
+            initializer=face_utils.warm_up, # Every worker loads dlib and runs a dummy inference as it starts
+        )
+        recognition_executor.start()
+        asyncio.create_task(warm_up_models()) # Camera, streaming and the connection come up while the models load
+        # Each camera captures on its own thread into its own ring of preallocated buffers, and has its own
+        # motion gate, scheduler and tracker; a higher camera resolution only affects encoding accuracy,
+        # detection always runs at detection_width. Keys of a config["cameras"] entry override the top level.
+        for (name, source), camera_config in zip(hardware.cameras, camera_configs(config)):
+            capture_thread = CaptureThread(
+                source,
+                # Every in-flight recognition and the stream may hold a slot; the writer always needs a free one
+                slots=camera_config.get("capture_slots", recognition_executor.workers + recognition_executor.queue_size + 4),
+                name=f"capture-{name}",
+            )
+            try:
+                capture_thread.start()
+            except Exception as e:
+                print(f"Camera {name} not started: {e}") # The other cameras keep working
+                continue
+            motion_gate = None
+            if camera_config.get("motion_enabled", True):
+                motion_gate = MotionGate(
+                    width=camera_config.get("motion_width", 160),
+                    pixel_threshold=camera_config.get("motion_pixel_threshold", 25),
+                    min_changed_fraction=camera_config.get("motion_min_changed_fraction", 0.01),
+                    learning_rate=camera_config.get("motion_learning_rate", 0.05),
+                )
+            cameras.append(CameraPipeline(
+                len(cameras),
+                name,
+                capture_thread,
+                AdaptiveScheduler(
+                    idle_interval=camera_config.get("idle_interval", 1.0),
+                    active_interval=camera_config.get("recognition_interval", 0.5),
+                    hold_seconds=camera_config.get("motion_hold_seconds", 5.0),
+                ),
+                FaceTracker(
+                    iou_threshold=camera_config.get("track_iou_threshold", 0.3),
+                    lost_seconds=camera_config.get("track_lost_seconds", 2.0),
+                    reverify_seconds=camera_config.get("track_reverify_seconds", 5.0),
+                    unknown_reverify_seconds=camera_config.get("track_unknown_reverify_seconds", 1.0),
+                ),
+                motion_gate,
+            ))
+        if not cameras:
+            print("No camera could be started.")
+            return
+        mark_startup("camera")
+        stream_controller = stream_utils.AdaptiveStreamController(
+            max_fps=config.get("stream_max_fps", 10),
+            min_fps=config.get("stream_min_fps", 1),
+            max_quality=config.get("stream_max_quality", 80),
+            min_quality=config.get("stream_min_quality", 30),
+            min_scale=config.get("stream_min_scale", 0.25),
+            max_kbps=config.get("stream_max_kbps", 0),
+            target_latency=config.get("stream_target_latency", 0.1),
+        )
+        asyncio.create_task(streaming_loop(stream_controller, config.get("stream_mode", "json")))
+        register_metric_sources(stream_controller)
+        metrics_port = config.get("metrics_port", 9108)
+        if metrics_port:
+            try:
+                metrics_runner = await serve_metrics(metrics, config.get("metrics_host", "127.0.0.1"), metrics_port)
+            except OSError as e:
+                print(f"Metrics endpoint not started: {e}")
+        metrics_interval = config.get("metrics_interval", 60)
+        if metrics_interval:
+            asyncio.create_task(metrics_loop(metrics_interval))
+        for camera in cameras:
+            asyncio.create_task(face_recognition_loop(camera, config.get("face_crop_padding", 0.25)))
+
+        while True:
+            await asyncio.sleep(1)
     except KeyboardInterrupt:
         print("Exiting...")
     finally:
-        GPIO.cleanup()
+        for camera in cameras:
+            camera.capture_thread.stop()
+        if attendance_store:
+            attendance_store.close()
+        if recognition_executor:
+            await recognition_executor.shutdown()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        if hardware:
+            if hardware.simulated:
+                print(f"Simulated hardware: {hardware.summary()}, frames captured: {({camera.name: camera.capture_thread.frames for camera in cameras})}")
+            hardware.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
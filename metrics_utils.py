@@ -0,0 +1,142 @@
+import bisect
+
+# Latency buckets in seconds, from sub-millisecond matching up to multi-second detection on a busy Pi
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+class Counter:
+    """Monotonic count; either incremented by the caller or read from fn() when collected."""
+
+    kind = "counter"
+
+    def __init__(self, name, labels=None, fn=None):
+        self.name = name
+        self.labels = labels or {}
+        self.fn = fn # Reads an existing counter (e.g. CaptureThread.frames) so the hot path pays nothing
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self):
+        return self.fn() if self.fn else self.value
+
+class Gauge(Counter):
+    """Value that can go up and down; set by the caller or read from fn() when collected."""
+
+    kind = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+class Histogram:
+    """Bucket counts plus sum and count, rendered cumulatively as Prometheus expects."""
+
+    kind = "histogram"
+
+    def __init__(self, name, labels=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1 # Per-bucket, accumulated only when rendered
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimates a quantile by interpolating inside the bucket it falls in."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+class MetricsRegistry:
+    """Named metrics of the device, rendered in the Prometheus text format or as a compact snapshot."""
+
+    def __init__(self):
+        self._metrics = {} # name -> (help text, [metric per label set])
+
+    def _register(self, metric, help_text):
+        entry = self._metrics.setdefault(metric.name, (help_text, []))
+        for existing in entry[1]:
+            if existing.labels == metric.labels:
+                return existing # Get-or-create: registering twice returns the original
+        entry[1].append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=None, fn=None):
+        return self._register(Counter(name, labels, fn), help_text)
+
+    def gauge(self, name, help_text, labels=None, fn=None):
+        return self._register(Gauge(name, labels, fn), help_text)
+
+    def histogram(self, name, help_text, labels=None, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, labels, buckets), help_text)
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        for name, (help_text, metrics) in self._metrics.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metrics[0].kind}")
+            for metric in metrics:
+                if metric.kind == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + ("+Inf",), metric.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(dict(metric.labels, le=bound))} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(metric.labels)} {metric.sum}")
+                    lines.append(f"{name}_count{format_labels(metric.labels)} {metric.count}")
+                else:
+                    try:
+                        value = metric.get()
+                    except Exception:
+                        continue # A source that is not running yet has no value
+                    lines.append(f"{name}{format_labels(metric.labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Returns {"name{labels}": value} for the server; histograms become count, sum, p50 and p95."""
+        data = {}
+        for name, (_, metrics) in self._metrics.items():
+            for metric in metrics:
+                key = name + format_labels(metric.labels)
+                if metric.kind == "histogram":
+                    data[key] = {"count": metric.count, "sum": round(metric.sum, 6),
+                                 "p50": metric.quantile(0.5), "p95": metric.quantile(0.95)}
+                else:
+                    try:
+                        data[key] = metric.get()
+                    except Exception:
+                        pass
+        return data
+
+async def serve_metrics(registry, host="127.0.0.1", port=9108):
+    """Serves GET /metrics in the Prometheus text format; returns the runner (call cleanup() to stop)."""
+    from aiohttp import web # Imported here so importing the metrics registry stays cheap
+    async def handle(request):
+        return web.Response(body=registry.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return runner
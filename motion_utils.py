@@ -0,0 +1,47 @@
+import time
+import cv2
+import numpy as np
+
+class MotionGate:
+    """Cheap scene-change detector comparing downscaled grayscale frames with a running background model."""
+
+    def __init__(self, width=160, pixel_threshold=25, min_changed_fraction=0.01, learning_rate=0.05):
+        self.width = width # Frames are shrunk to this width before comparison
+        self.pixel_threshold = pixel_threshold # Grey-level difference for a pixel to count as changed
+        self.min_changed_fraction = min_changed_fraction # Fraction of changed pixels that counts as motion
+        self.learning_rate = learning_rate # How fast the background absorbs slow changes (lighting, moved furniture)
+        self.last_changed_fraction = 0.0
+        self._background = None
+
+    def update(self, frame):
+        """Feeds a frame into the background model and returns True if the scene changed."""
+        height = max(1, frame.shape[0] * self.width // frame.shape[1])
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA) # Shrink first so the colour conversion is cheap
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        gray = cv2.GaussianBlur(gray, (5, 5), 0) # Suppress sensor noise
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype(np.float32)
+            return True # No reference yet, let the first frame through
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        self.last_changed_fraction = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+        cv2.accumulateWeighted(gray, self._background, self.learning_rate)
+        return self.last_changed_fraction >= self.min_changed_fraction
+
+class AdaptiveScheduler:
+    """Polls slowly while the scene is idle and at the maximum recognition rate after recent activity."""
+
+    def __init__(self, idle_interval=1.0, active_interval=0.5, hold_seconds=5.0):
+        self.idle_interval = idle_interval
+        self.active_interval = active_interval
+        self.hold_seconds = hold_seconds # Stay at the active rate this long after the last motion or face
+        self._last_activity = None
+
+    def mark_active(self):
+        self._last_activity = time.monotonic()
+
+    def is_active(self):
+        return self._last_activity is not None and time.monotonic() - self._last_activity < self.hold_seconds
+
+    def interval(self):
+        """Returns the number of seconds to wait before the next tick."""
+        return self.active_interval if self.is_active() else self.idle_interval
@@ -0,0 +1,128 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import signal
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+def process_context():
+    """Start method for worker processes: never fork, because by the time the first worker starts the parent runs
+    capture, LCD and index threads whose locks a forked child could inherit in a held state."""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+def init_worker_process(initializer=None):
+    """Runs in every worker process as it starts: Ctrl+C reaches the whole process group, but only the parent shuts down."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer:
+        initializer()
+
+class RecognitionExecutor:
+    """Runs recognition jobs on a worker pool behind bounded, drop-oldest queues, one per source, served round-robin."""
+
+    def __init__(self, fn, workers=None, mode="process", queue_size=2, observe_latency=None, initializer=None):
+        self.fn = fn # Must be a module-level function so it can be pickled for the process pool
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.mode = mode
+        self.queue_size = max(1, queue_size)
+        self.observe_latency = observe_latency # Optional callback(seconds) for every completed job
+        self.initializer = initializer # Module-level function run once in every worker as it starts (e.g. model warm-up)
+        self.submitted = 0
+        self.dropped = 0
+        self._pool = None
+        self._queues = {} # source -> deque of (args, future), each at most queue_size long
+        self._sources = [] # Round-robin order of the sources
+        self._next = 0
+        self._ready = None # Set while any queue has a job
+        self._tasks = []
+
+    def start(self):
+        """Creates the worker pool and one dispatcher task per worker (call from the running event loop)."""
+        if self.mode == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="recognition", initializer=self.initializer)
+        else:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=process_context(),
+                                             initializer=functools.partial(init_worker_process, self.initializer))
+        self._ready = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+        print(f"Recognition executor started: {self.workers} {self.mode} worker(s).")
+
+    def submit(self, *args, source=0):
+        """Queues a job without blocking and returns a future for its result; drops the source's oldest job when full."""
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(source)
+        if queue is None:
+            queue = self._queues[source] = deque()
+            self._sources.append(source)
+        if len(queue) >= self.queue_size:
+            _, stale_future = queue.popleft() # Stale frames are worthless, make room for the newest one
+            stale_future.cancel()
+            self.dropped += 1
+        queue.append((args, future))
+        self.submitted += 1
+        self._ready.set()
+        return future
+
+    def _take(self):
+        """Takes the next job, visiting the sources in turn so a busy camera cannot starve the others."""
+        for i in range(len(self._sources)):
+            position = (self._next + i) % len(self._sources)
+            queue = self._queues[self._sources[position]]
+            if queue:
+                self._next = position + 1
+                return queue.popleft()
+        return None
+
+    async def run(self, fn, *args):
+        """Runs a follow-up job (e.g. encoding crops of an already detected frame) on the pool, bypassing the queue."""
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    async def warm_up(self, fn):
+        """Runs fn once per worker, which also starts every worker (and its initializer) now instead of on the first frame."""
+        return await asyncio.gather(*(self.run(fn) for _ in range(self.workers)))
+
+    def queue_depth(self, source=None):
+        """Returns the number of jobs waiting for a free worker (for one source, or in total)."""
+        if source is not None:
+            return len(self._queues.get(source, ()))
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def _dispatch(self):
+        """Feeds queued jobs to the pool; the event loop only awaits their results."""
+        loop = asyncio.get_running_loop()
+        while True:
+            job = self._take()
+            if job is None:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            args, future = job
+            if future.cancelled():
+                continue
+            started = time.monotonic()
+            try:
+                result = await loop.run_in_executor(self._pool, self.fn, *args)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if self.observe_latency:
+                    self.observe_latency(time.monotonic() - started)
+                if not future.done():
+                    future.set_result(result)
+
+    async def shutdown(self):
+        """Stops the dispatchers and the worker pool."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
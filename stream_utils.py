@@ -1,8 +1,98 @@
 import cv2
 import base64
+import struct
+import time
 
-def encode_frame(frame):
+# Binary live-stream frame: header followed by the JPEG bytes
+# magic, version, source (camera index), sequence number, capture time (ms), width, height, JPEG quality
+FRAME_HEADER = struct.Struct("!2sBBIQHHB")
+FRAME_MAGIC = b"ST"
+FRAME_VERSION = 1
+
+def encode_jpeg(frame, quality=80, scale=1.0):
+    """JPEG-encodes a frame at the given quality and scale; returns (jpeg bytes, width, height)."""
+    if scale < 1.0:
+        frame = cv2.resize(frame, (int(frame.shape[1] * scale), int(frame.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+    if frame.ndim == 3 and frame.shape[2] == 4:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR) # Camera frames carry an unused alpha channel
+    _, frame_encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    return frame_encoded.tobytes(), frame.shape[1], frame.shape[0]
+
+def encode_frame(frame, quality=80, scale=1.0):
     """Encodes a frame to base64."""
-    _, frame_encoded = cv2.imencode('.jpg', frame)
+    frame_encoded, _, _ = encode_jpeg(frame, quality, scale)
     frame_base64 = base64.b64encode(frame_encoded).decode('utf-8')
-    return frame_base64
\ No newline at end of file
+    return frame_base64
+
+def pack_frame(jpeg, sequence, width, height, quality, source=0, timestamp=None):
+    """Prefixes JPEG bytes with the binary frame header."""
+    timestamp_ms = int((time.time() if timestamp is None else timestamp) * 1000)
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, source, sequence & 0xFFFFFFFF, timestamp_ms, width, height, int(quality))
+    return header + jpeg
+
+def unpack_frame(payload):
+    """Splits a binary frame into its header fields (as a dict) and the JPEG bytes."""
+    magic, version, source, sequence, timestamp_ms, width, height, quality = FRAME_HEADER.unpack_from(payload)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Not a StreakTrack stream frame.")
+    header = {"version": version, "source": source, "sequence": sequence, "timestamp_ms": timestamp_ms,
+              "width": width, "height": height, "quality": quality}
+    return header, payload[FRAME_HEADER.size:]
+
+def write_buffer_size(websocket):
+    """Returns the bytes queued in the websocket's transport but not yet sent (0 if unknown)."""
+    transport = getattr(websocket, "transport", None)
+    try:
+        return transport.get_write_buffer_size() if transport else 0
+    except Exception:
+        return 0
+
+class AdaptiveStreamController:
+    """Adapts JPEG quality, resolution and frame rate to send latency and queue depth, under a bandwidth cap."""
+
+    def __init__(self, max_fps=10, min_fps=1, max_quality=80, min_quality=30, min_scale=0.25,
+                 max_kbps=0, target_latency=0.1, max_buffered_bytes=64 * 1024):
+        self.max_fps, self.min_fps = max_fps, min_fps
+        self.max_quality, self.min_quality = max_quality, min_quality
+        self.min_scale = min_scale
+        self.max_bytes_per_second = max_kbps * 1000 / 8 if max_kbps else 0 # 0 disables the cap
+        self.target_latency = target_latency # Sends slower than this mean the uplink is congested
+        self.max_buffered_bytes = max_buffered_bytes
+        self.fps = max_fps
+        self.quality = max_quality
+        self.scale = 1.0
+        self.latency = 0.0 # Smoothed send latency in seconds
+        self._tokens = self.max_bytes_per_second
+        self._refilled = time.monotonic()
+
+    def frame_interval(self):
+        return 1.0 / self.fps
+
+    def bandwidth_delay(self, nbytes):
+        """Takes nbytes from the token bucket and returns how long to wait so the cap is respected."""
+        if not self.max_bytes_per_second:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.max_bytes_per_second, self._tokens + (now - self._refilled) * self.max_bytes_per_second)
+        self._refilled = now
+        self._tokens -= nbytes
+        return max(0.0, -self._tokens / self.max_bytes_per_second)
+
+    def record_send(self, latency, buffered_bytes=0):
+        """Feeds one send measurement back: degrade on congestion, recover slowly when the link is clear."""
+        self.latency = latency if not self.latency else 0.8 * self.latency + 0.2 * latency
+        if self.latency > self.target_latency or buffered_bytes > self.max_buffered_bytes:
+            # Cheapest visual loss first: quality, then resolution, then frame rate
+            if self.quality > self.min_quality:
+                self.quality = max(self.min_quality, self.quality - 10)
+            elif self.scale > self.min_scale:
+                self.scale = max(self.min_scale, self.scale * 0.75)
+            else:
+                self.fps = max(self.min_fps, self.fps * 0.75)
+        elif self.latency < self.target_latency / 2 and buffered_bytes == 0:
+            if self.fps < self.max_fps:
+                self.fps = min(self.max_fps, self.fps + 1)
+            elif self.scale < 1.0:
+                self.scale = min(1.0, self.scale / 0.9)
+            elif self.quality < self.max_quality:
+                self.quality = min(self.max_quality, self.quality + 2)
@@ -0,0 +1,64 @@
+from datetime import datetime
+import pytest
+from attendance_utils import AttendanceStore
+
+MONDAY = datetime(2026, 3, 2, 9, 0)
+MONDAY_LATER = datetime(2026, 3, 2, 15, 30)
+TUESDAY = datetime(2026, 3, 3, 9, 0)
+
+@pytest.fixture
+def store(tmp_path):
+    store = AttendanceStore(str(tmp_path / "attendance.db"))
+    yield store
+    store.close()
+
+def event(student_id):
+    return {"type": "attendance", "student": {"studentId": student_id}}
+
+def test_a_student_is_marked_once_per_day(store):
+    assert store.mark(["s1", "s2", "s1"], MONDAY) == ["s1", "s2"]
+    assert store.is_marked("s1", MONDAY_LATER)
+    assert store.mark(["s1", "s3"], MONDAY_LATER) == ["s3"]
+    assert not store.is_marked("s1", TUESDAY) # A new day starts over
+    assert store.mark(["s1"], TUESDAY) == ["s1"]
+
+def test_marks_survive_a_restart(tmp_path):
+    path = str(tmp_path / "attendance.db")
+    first = AttendanceStore(path)
+    first.mark(["s1"], MONDAY, [event("s1")])
+    first.close()
+    second = AttendanceStore(path)
+    try:
+        assert second.is_marked("s1", MONDAY_LATER)
+        assert [message for _, message in second.pending()] == [event("s1")]
+    finally:
+        second.close()
+
+def test_outbox_keeps_the_marking_order(store):
+    store.mark(["s1"], MONDAY, [event("s1")])
+    store.mark(["s2", "s3"], MONDAY, [event("s2"), event("s3")])
+    pending = store.pending()
+    assert [message["student"]["studentId"] for _, message in pending] == ["s1", "s2", "s3"]
+    assert [outbox_id for outbox_id, _ in pending] == sorted(outbox_id for outbox_id, _ in pending)
+    assert [message for _, message in store.pending(limit=2)] == [event("s1"), event("s2")]
+
+def test_ack_removes_only_delivered_events(store):
+    store.mark(["s1", "s2", "s3"], MONDAY, [event("s1"), event("s2"), event("s3")])
+    ids = [outbox_id for outbox_id, _ in store.pending()]
+    store.ack(ids[:2])
+    assert store.pending_count() == 1
+    assert [message for _, message in store.pending()] == [event("s3")]
+
+def test_in_flight_events_wait_for_their_ack(store):
+    store.mark(["s1", "s2"], MONDAY, [event("s1"), event("s2")])
+    first_id = store.pending()[0][0]
+    store.in_flight.add(first_id) # Sent, not acknowledged yet
+    assert [message for _, message in store.pending()] == [event("s2")]
+    assert store.pending_count() == 2
+    store.ack([first_id])
+    assert store.in_flight == set() and store.pending_count() == 1
+
+def test_in_flight_events_do_not_shrink_a_batch(store):
+    store.mark(["s1", "s2", "s3"], MONDAY, [event("s1"), event("s2"), event("s3")])
+    store.in_flight.add(store.pending()[0][0])
+    assert len(store.pending(limit=2)) == 2
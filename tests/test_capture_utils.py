@@ -0,0 +1,154 @@
+import random
+import time
+import pytest
+from capture_utils import CaptureThread, FrameRing, SyntheticSource
+
+SHAPE = (4, 4, 3)
+
+def write(ring, value):
+    """Writes one frame filled with value; returns its slot, or None when the ring is full."""
+    writable = ring.writable_slot()
+    if writable is None:
+        return None
+    slot, buffer = writable
+    buffer[:] = value
+    ring.commit(slot)
+    return slot
+
+def test_acquire_returns_only_newer_frames():
+    ring = FrameRing(3, SHAPE)
+    assert ring.acquire() is None
+    write(ring, 1)
+    ref = ring.acquire()
+    assert ref.sequence == 1 and ref.frame[0, 0, 0] == 1
+    assert ring.acquire(ref.sequence) is None # Nothing newer yet
+    ref.release()
+
+def test_frames_are_read_only_views():
+    ring = FrameRing(3, SHAPE)
+    write(ring, 1)
+    ref = ring.acquire()
+    with pytest.raises(ValueError):
+        ref.frame[0, 0, 0] = 9
+    ref.release()
+
+def test_borrowed_and_latest_slots_are_never_written():
+    ring = FrameRing(3, SHAPE)
+    borrowed_slot = write(ring, 1)
+    ref = ring.acquire()
+    for value in range(2, 20):
+        slot = write(ring, value)
+        assert slot != borrowed_slot
+    assert ref.frame.min() == ref.frame.max() == 1 # The borrowed frame was never overwritten
+    ref.release()
+
+def test_slot_being_written_is_never_handed_out():
+    ring = FrameRing(3, SHAPE)
+    write(ring, 1)
+    slot, buffer = ring.writable_slot() # Being written: not committed yet
+    buffer[:] = 2
+    ref = ring.acquire()
+    assert ref.slot != slot and ref.frame[0, 0, 0] == 1
+    ref.release()
+    ring.commit(slot)
+    assert ring.acquire().frame[0, 0, 0] == 2
+
+def test_full_ring_drops_instead_of_overwriting():
+    ring = FrameRing(3, SHAPE)
+    refs = []
+    for value in range(1, 4):
+        write(ring, value)
+        refs.append(ring.acquire(refs[-1].sequence if refs else 0))
+    assert ring.writable_slot() is None
+    assert ring.full_dropped == 1
+    refs[0].release()
+    assert write(ring, 4) == refs[0].slot
+
+def test_unread_frames_are_counted_when_overwritten():
+    ring = FrameRing(3, SHAPE)
+    for value in range(1, 6):
+        write(ring, value)
+    assert ring.unread_dropped == 2 # Frames 1 and 2 were recycled without anyone reading them
+
+def test_random_borrowing_never_corrupts_a_held_frame():
+    rng = random.Random(0)
+    ring = FrameRing(4, SHAPE)
+    held = []
+    value = 0
+    for _ in range(2000):
+        action = rng.random()
+        if action < 0.5:
+            value += 1
+            slot = write(ring, value % 250)
+            assert slot is None or all(slot != ref.slot for ref, _ in held)
+        elif action < 0.75:
+            ref = ring.acquire()
+            if ref is not None:
+                held.append((ref, int(ref.frame[0, 0, 0])))
+        elif held:
+            ref, expected = held.pop(rng.randrange(len(held)))
+            assert ref.frame.min() == ref.frame.max() == expected
+            ref.release()
+    for ref, expected in held:
+        assert ref.frame.min() == ref.frame.max() == expected
+
+class CountingSource:
+    """Fills every frame with a running counter, so a torn or overwritten frame is visible."""
+
+    def __init__(self):
+        self.value = 0
+
+    def start(self):
+        return SHAPE
+
+    def read_into(self, buffer):
+        self.value = (self.value + 1) % 250
+        buffer[:] = self.value
+        return True
+
+    def stop(self):
+        pass
+
+def test_capture_thread_never_overwrites_a_borrowed_frame():
+    capture = CaptureThread(CountingSource(), slots=3)
+    ring = capture.start()
+    try:
+        checked = 0
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            ref = ring.acquire()
+            if ref is None:
+                continue
+            expected = int(ref.frame[0, 0, 0])
+            time.sleep(0.001) # The capture thread keeps writing meanwhile
+            assert ref.frame.min() == ref.frame.max() == expected
+            ref.release()
+            checked += 1
+        assert checked > 10
+    finally:
+        capture.stop()
+        capture.join(2)
+
+def test_synthetic_source_fills_the_ring():
+    capture = CaptureThread(SyntheticSource(64, 48, fps=0), slots=3)
+    ring = capture.start()
+    try:
+        deadline = time.monotonic() + 2.0
+        while capture.frames < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        ref = ring.acquire()
+        assert ref.frame.shape == (48, 64, 3)
+        ref.release()
+    finally:
+        capture.stop()
+        capture.join(2)
+    assert capture.frames >= 5
+
+def test_frames_carry_their_wall_clock_capture_time():
+    ring = FrameRing(3, SHAPE)
+    before = time.time()
+    write(ring, 1)
+    time.sleep(0.05)
+    ref = ring.acquire()
+    assert before <= ref.captured_at <= before + 0.04 # Stamped at commit, not when the frame is read
+    ref.release()
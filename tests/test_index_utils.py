@@ -0,0 +1,152 @@
+import os
+import pickle
+import sqlite3
+import time
+import numpy as np
+import pytest
+from index_utils import (ENCODING_FORMAT_VERSION, ENCODING_SIZE, BruteForceSearch, EmbeddingIndex, IVFSearch, database_stamp,
+                         migrate_encodings, pack_encodings, read_snapshot, unpack_encodings, write_snapshot)
+
+def random_encodings(rows, seed=0):
+    return np.random.default_rng(seed).normal(size=(rows, ENCODING_SIZE)).astype(np.float32)
+
+def labels_for(rows):
+    labels = np.empty(rows, dtype=object)
+    labels[:] = [f"s{row}" for row in range(rows)]
+    return labels
+
+def test_pack_round_trip():
+    encodings = random_encodings(3)
+    assert np.array_equal(unpack_encodings(pack_encodings(list(encodings))), encodings)
+
+def test_ivf_probing_every_list_equals_exact_search():
+    matrix, labels = random_encodings(2000), labels_for(2000)
+    queries = random_encodings(50, seed=1)
+    ivf = IVFSearch(matrix, labels, nlist=16, nprobe=16)
+    exact = BruteForceSearch(matrix, labels)
+    ivf_best, ivf_dist = ivf.search(queries)
+    exact_best, exact_dist = exact.search(queries)
+    assert list(ivf.labels[ivf_best]) == list(exact.labels[exact_best])
+    assert np.allclose(ivf_dist, exact_dist, atol=1e-4)
+
+def test_ivf_finds_stored_encodings():
+    matrix, labels = random_encodings(2000), labels_for(2000)
+    ivf = IVFSearch(matrix, labels, nlist=16, nprobe=2)
+    best, dist = ivf.search(matrix[:100]) # Each query's own list is always among the closest probes
+    assert list(ivf.labels[best]) == list(labels[:100])
+    assert np.allclose(dist, 0.0, atol=1e-2)
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "faces.emb")
+    matrix = random_encodings(5)
+    labels = np.array(["a", "b", "a", "c", "b"], dtype=object)
+    write_snapshot(path, labels, matrix, (123, 456))
+    loaded_labels, loaded = read_snapshot(path, (123, 456))
+    assert list(loaded_labels) == list(labels)
+    assert np.array_equal(loaded, matrix)
+
+def test_float16_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "faces.emb")
+    matrix = random_encodings(5)
+    write_snapshot(path, labels_for(5), matrix, (1, 2), dtype="float16")
+    _, loaded = read_snapshot(path, (1, 2))
+    assert loaded.dtype == np.float32
+    assert np.allclose(loaded, matrix, atol=1e-2)
+
+def test_stale_or_damaged_snapshot_is_rejected(tmp_path):
+    path = str(tmp_path / "faces.emb")
+    write_snapshot(path, labels_for(5), random_encodings(5), (123, 456))
+    assert read_snapshot(path, (123, 457)) is None # Written for another version of the database
+    assert read_snapshot(str(tmp_path / "missing.emb")) is None
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 8)
+    assert read_snapshot(path, (123, 456)) is None
+    with open(path, "r+b") as f:
+        f.write(b"NOTEMB")
+    assert read_snapshot(path) is None
+
+def make_database(path, students, pickled=False):
+    db_conn = sqlite3.connect(path)
+    db_conn.execute("CREATE TABLE students (student_id TEXT PRIMARY KEY, encoding BLOB, image_hash TEXT)")
+    encode = (lambda encodings: pickle.dumps(list(encodings))) if pickled else (lambda encodings: pack_encodings(list(encodings)))
+    db_conn.executemany("INSERT INTO students VALUES (?, ?, '')", [(student_id, encode(encodings)) for student_id, encodings in students.items()])
+    if not pickled:
+        db_conn.execute(f"PRAGMA user_version = {ENCODING_FORMAT_VERSION}")
+    db_conn.commit()
+    db_conn.close()
+
+def test_pickled_database_is_migrated_once(tmp_path):
+    db_path = str(tmp_path / "student_faces.db")
+    encodings = random_encodings(2)
+    make_database(db_path, {"s1": encodings}, pickled=True)
+    db_conn = sqlite3.connect(db_path)
+    try:
+        assert migrate_encodings(db_conn) == 1
+        assert migrate_encodings(db_conn) == 0
+        [(blob,)] = db_conn.execute("SELECT encoding FROM students").fetchall()
+        assert np.array_equal(unpack_encodings(blob), encodings)
+    finally:
+        db_conn.close()
+
+def test_index_reload_writes_and_then_uses_the_snapshot(tmp_path):
+    db_path = str(tmp_path / "student_faces.db")
+    students = {"s1": random_encodings(2, seed=1), "s2": random_encodings(1, seed=2)}
+    make_database(db_path, students)
+    index = EmbeddingIndex(db_path)
+    assert index.reload() == 3
+    assert read_snapshot(index.snapshot_path, database_stamp(db_path)) is not None
+    again = EmbeddingIndex(db_path)
+    assert again.reload() == 3
+    assert again.match(students["s2"]) == [("s2", pytest.approx(0.0, abs=1e-3))]
+
+def test_changed_database_invalidates_the_snapshot(tmp_path):
+    db_path = str(tmp_path / "student_faces.db")
+    make_database(db_path, {"s1": random_encodings(1, seed=1)})
+    index = EmbeddingIndex(db_path)
+    index.reload()
+    time.sleep(0.01)
+    db_conn = sqlite3.connect(db_path)
+    db_conn.execute("INSERT INTO students VALUES ('s2', ?, '')", (pack_encodings(list(random_encodings(1, seed=2))),))
+    db_conn.commit()
+    db_conn.close()
+    assert read_snapshot(index.snapshot_path, database_stamp(db_path)) is None
+    assert EmbeddingIndex(db_path).reload() == 2
+
+def test_restricted_matching_only_returns_allowed_students():
+    index = EmbeddingIndex("unused.db")
+    encodings = random_encodings(3)
+    index.load(["s1", "s2", "s3"], encodings)
+    index.restrict(["s2"])
+    assert index.match(encodings[:1], threshold=100.0)[0][0] == "s2"
+    assert index.match(encodings[:1], threshold=0.01) == [("Unknown", pytest.approx(float(np.linalg.norm(encodings[0] - encodings[1]))))]
+    index.restrict(None)
+    assert index.match(encodings[:1])[0][0] == "s1"
+
+def test_ivf_index_replaces_exact_search_once_built():
+    index = EmbeddingIndex("unused.db", index_type="ivf", nlist=8, nprobe=8)
+    encodings = random_encodings(500)
+    index.load([f"s{row}" for row in range(500)], encodings)
+    deadline = time.monotonic() + 10
+    while index.search_kind() != "ivf" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert index.search_kind() == "ivf"
+    assert [student_id for student_id, _ in index.match(encodings[:20])] == [f"s{row}" for row in range(20)]
+
+def test_sync_changes_are_installed_in_one_swap(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "student_faces.db")
+    make_database(db_path, {"s1": random_encodings(1, seed=1), "s2": random_encodings(1, seed=2), "s3": random_encodings(1, seed=3)})
+    index = EmbeddingIndex(db_path)
+    index.reload()
+    changed = random_encodings(2, seed=4)
+    db_conn = sqlite3.connect(db_path)
+    db_conn.execute("UPDATE students SET encoding = ? WHERE student_id = 's1'", (pack_encodings(list(changed)),))
+    db_conn.execute("DELETE FROM students WHERE student_id = 's2'")
+    db_conn.commit()
+    db_conn.close()
+    installs = []
+    install = index._install
+    monkeypatch.setattr(index, "_install", lambda matrix, labels: (installs.append(len(labels)), install(matrix, labels)))
+    index.apply_changes(["s1"], ["s2"])
+    assert installs == [3]
+    assert sorted(index.contents()[0]) == ["s1", "s1", "s3"]
+    assert index.match(changed[1:])[0][0] == "s1"
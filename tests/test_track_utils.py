@@ -0,0 +1,73 @@
+from track_utils import FaceTracker, box_iou
+
+# (top, right, bottom, left) boxes
+FACE_A = (10, 60, 60, 10)
+FACE_A_MOVED = (12, 64, 62, 14)
+FACE_B = (10, 200, 60, 150)
+
+def test_box_iou():
+    assert box_iou(FACE_A, FACE_A) == 1.0
+    assert box_iou(FACE_A, FACE_B) == 0.0
+    assert box_iou((0, 10, 10, 0), (0, 15, 10, 5)) == 50 / 150
+
+def test_overlapping_boxes_continue_the_same_track():
+    tracker = FaceTracker()
+    [first] = tracker.update([FACE_A], now=0.0)
+    [second] = tracker.update([FACE_A_MOVED], now=0.1)
+    assert second is first and second.box == FACE_A_MOVED
+
+def test_each_box_gets_its_own_track():
+    tracker = FaceTracker()
+    a, b = tracker.update([FACE_A, FACE_B], now=0.0)
+    assert a is not b
+    # Order of the boxes in a later frame does not matter
+    b2, a2 = tracker.update([FACE_B, FACE_A_MOVED], now=0.1)
+    assert a2 is a and b2 is b
+
+def test_low_overlap_starts_a_new_track():
+    tracker = FaceTracker(iou_threshold=0.3)
+    [first] = tracker.update([FACE_A], now=0.0)
+    [second] = tracker.update([(40, 100, 90, 50)], now=0.1)
+    assert second is not first
+
+def test_one_event_per_appearance():
+    tracker = FaceTracker(reverify_seconds=5.0)
+    [track] = tracker.update([FACE_A], now=0.0)
+    assert tracker.needs_identity(track, now=0.0)
+    assert tracker.assign(track, "s1", 0.3, now=0.0) # First identification: one event
+
+    [track] = tracker.update([FACE_A_MOVED], now=1.0)
+    assert not tracker.needs_identity(track, now=1.0) # Not encoded again until re-verification is due
+    assert tracker.needs_identity(track, now=5.0)
+    assert not tracker.assign(track, "s1", 0.32, now=5.0) # Same student again: no second event
+
+def test_identity_change_is_a_new_event():
+    tracker = FaceTracker()
+    [track] = tracker.update([FACE_A], now=0.0)
+    tracker.assign(track, "s1", 0.3, now=0.0)
+    assert tracker.assign(track, "s2", 0.3, now=6.0)
+
+def test_unknown_on_reverification_keeps_the_identity():
+    tracker = FaceTracker()
+    [track] = tracker.update([FACE_A], now=0.0)
+    tracker.assign(track, "s1", 0.3, now=0.0)
+    assert not tracker.assign(track, "Unknown", 0.7, now=6.0)
+    assert track.student_id == "s1"
+
+def test_unknown_tracks_are_retried_sooner():
+    tracker = FaceTracker(reverify_seconds=5.0, unknown_reverify_seconds=1.0)
+    [track] = tracker.update([FACE_A], now=0.0)
+    assert tracker.assign(track, "Unknown", 0.7, now=0.0)
+    assert not tracker.needs_identity(track, now=0.5)
+    assert tracker.needs_identity(track, now=1.0)
+
+def test_lost_track_reappearance_is_a_new_event():
+    tracker = FaceTracker(lost_seconds=2.0)
+    [track] = tracker.update([FACE_A], now=0.0)
+    tracker.assign(track, "s1", 0.3, now=0.0)
+    tracker.update([], now=1.0)
+    [same] = tracker.update([FACE_A], now=1.5) # Missed a few frames but still within lost_seconds
+    assert same is track
+    [again] = tracker.update([FACE_A], now=4.0) # Gone for longer: a new appearance
+    assert again is not track and tracker.needs_identity(again, now=4.0)
+    assert tracker.assign(again, "s1", 0.3, now=4.0)
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import time
+import pytest
+import websockets
+from ws_utils import ConnectionManager, PRIORITY_ATTENDANCE, PRIORITY_DETECTED
+
+def run(coro, timeout=10):
+    return asyncio.run(asyncio.wait_for(coro, timeout))
+
+class StandInServer:
+    """Local websockets.serve endpoint that records every frame a device sends; close_after drops each connection."""
+
+    def __init__(self, close_after=None):
+        self.close_after = close_after
+        self.connections = 0
+        self.connect_times = []
+        self.frames = []
+        self.received = asyncio.Event()
+
+    async def handler(self, websocket, *args):
+        self.connections += 1
+        self.connect_times.append(time.monotonic())
+        if self.close_after is not None:
+            await asyncio.sleep(self.close_after)
+            await websocket.close()
+            return
+        async for message in websocket:
+            self.frames.append(message if isinstance(message, bytes) else json.loads(message))
+            self.received.set()
+
+    async def __aenter__(self):
+        self._server = await websockets.serve(self.handler, "127.0.0.1", 0)
+        self.uri = f"ws://127.0.0.1:{self._server.sockets[0].getsockname()[1]}"
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        await self._server.wait_closed()
+
+async def start(manager):
+    task = asyncio.create_task(manager.run())
+    await asyncio.wait_for(manager.connected.wait(), 5)
+    return task
+
+async def stop(task):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+async def wait_for_frames(server, count):
+    while len(server.frames) < count:
+        server.received.clear()
+        await asyncio.wait_for(server.received.wait(), 5)
+
+def test_messages_queued_together_are_sent_as_one_batch():
+    async def scenario():
+        async with StandInServer() as server:
+            manager = ConnectionManager(server.uri, heartbeat_interval=60)
+            # Queued before the connection exists, so the sender finds all of them at once
+            futures = [await manager.send({"type": "attendance", "n": n}, PRIORITY_ATTENDANCE) for n in range(3)]
+            task = await start(manager)
+            await asyncio.gather(*futures)
+            await wait_for_frames(server, 1)
+            await stop(task)
+            return server.frames
+    frames = run(scenario())
+    assert frames == [{"type": "batch", "messages": [{"type": "attendance", "n": n} for n in range(3)]}]
+
+def test_batches_respect_batch_max():
+    async def scenario():
+        async with StandInServer() as server:
+            manager = ConnectionManager(server.uri, heartbeat_interval=60, batch_max=2)
+            futures = [await manager.send({"n": n}, PRIORITY_ATTENDANCE) for n in range(5)]
+            task = await start(manager)
+            await asyncio.gather(*futures)
+            await wait_for_frames(server, 3)
+            await stop(task)
+            return server.frames
+    frames = run(scenario())
+    assert [len(frame["messages"]) if "messages" in frame else 1 for frame in frames] == [2, 2, 1]
+
+def test_attendance_goes_before_detected_and_stream_frames():
+    async def scenario():
+        async with StandInServer() as server:
+            manager = ConnectionManager(server.uri, heartbeat_interval=60)
+            frame = manager.offer_frame(b"jpeg")
+            detected = await manager.send({"type": "detected"}, PRIORITY_DETECTED)
+            attendance = await manager.send({"type": "attendance"}, PRIORITY_ATTENDANCE)
+            task = await start(manager)
+            await asyncio.gather(frame, detected, attendance)
+            await wait_for_frames(server, 2)
+            await stop(task)
+            return server.frames
+    frames = run(scenario())
+    assert frames == [{"type": "batch", "messages": [{"type": "attendance"}, {"type": "detected"}]}, b"jpeg"]
+
+def test_a_newer_stream_frame_replaces_the_queued_one():
+    async def scenario():
+        manager = ConnectionManager("ws://unused")
+        old = manager.offer_frame(b"old")
+        new = manager.offer_frame(b"new")
+        return old.cancelled(), new.done(), manager.queue_depth()
+    assert run(scenario()) == (True, False, 1)
+
+def test_send_waits_while_its_queue_is_full():
+    async def scenario():
+        async with StandInServer() as server:
+            manager = ConnectionManager(server.uri, heartbeat_interval=60, queue_sizes=(2, 2, 1))
+            await manager.send({"n": 0}, PRIORITY_ATTENDANCE)
+            await manager.send({"n": 1}, PRIORITY_ATTENDANCE)
+            blocked = asyncio.create_task(manager.send({"n": 2}, PRIORITY_ATTENDANCE))
+            await asyncio.sleep(0.2)
+            waited = not blocked.done() # Backpressure: the producer is held until the sender makes room
+            task = await start(manager)
+            await asyncio.wait_for(await blocked, 5)
+            await stop(task)
+            return waited
+    assert run(scenario())
+
+def test_offer_never_waits_and_drops_the_oldest():
+    async def scenario():
+        manager = ConnectionManager("ws://unused", queue_sizes=(2, 2, 1))
+        futures = [manager.offer({"n": n}, PRIORITY_DETECTED) for n in range(3)]
+        return [future.cancelled() for future in futures], manager.queue_depth(PRIORITY_DETECTED)
+    assert run(scenario()) == ([True, False, False], 2)
+
+def test_backoff_applies_after_dropped_connections():
+    async def scenario():
+        # Accepts and immediately closes: without a wait between attempts this is a reconnect storm
+        async with StandInServer(close_after=0) as server:
+            manager = ConnectionManager(server.uri, heartbeat_interval=60, min_backoff=0.2, max_backoff=1.0)
+            task = asyncio.create_task(manager.run())
+            await asyncio.sleep(2.0)
+            await stop(task)
+            return server.connect_times
+    connect_times = run(scenario())
+    gaps = [later - earlier for earlier, later in zip(connect_times, connect_times[1:])]
+    assert 3 <= len(connect_times) <= 8
+    assert all(gap >= 0.09 for gap in gaps) # At least half of min_backoff (full jitter range)
+    assert gaps[-1] > gaps[0] # The delay grows while connections keep failing
+
+def test_backoff_applies_after_failed_connects():
+    async def scenario():
+        attempts = []
+        async def refuse(uri):
+            attempts.append(time.monotonic())
+            raise OSError("refused")
+        manager = ConnectionManager("ws://unused", connect=refuse, min_backoff=0.1, max_backoff=0.4)
+        task = asyncio.create_task(manager.run())
+        await asyncio.sleep(1.0)
+        await stop(task)
+        return attempts
+    attempts = run(scenario())
+    assert 3 <= len(attempts) <= 8
+
+class StalledWebSocket:
+    """Accepts the first send and never finishes it, like a link whose buffers are full; close() ends the connection."""
+
+    def __init__(self):
+        self.closed = asyncio.Event()
+
+    async def send(self, data):
+        await asyncio.Event().wait()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self.closed.wait()
+        raise StopAsyncIteration
+
+    async def close(self):
+        self.closed.set()
+
+def test_queued_messages_fail_when_the_connection_drops():
+    async def scenario():
+        websocket = StalledWebSocket()
+        async def connect(uri):
+            return websocket
+        manager = ConnectionManager("ws://unused", connect=connect, heartbeat_interval=60, min_backoff=30)
+        task = await start(manager)
+        in_flight = await manager.send({"n": 0}, PRIORITY_ATTENDANCE)
+        await asyncio.sleep(0.05) # The sender is now stuck in websocket.send
+        queued = await manager.send({"n": 1}, PRIORITY_ATTENDANCE)
+        frame = manager.offer_frame(b"jpeg")
+        await websocket.close()
+        with pytest.raises(ConnectionError):
+            await asyncio.wait_for(queued, 5)
+        with pytest.raises(ConnectionError):
+            await asyncio.wait_for(frame, 5)
+        disconnected = not manager.is_connected()
+        await stop(task)
+        return in_flight.done(), disconnected
+    # The message already handed to the socket is neither delivered nor failed yet; the queue behind it is failed
+    assert run(scenario()) == (False, True)
@@ -0,0 +1,82 @@
+import itertools
+import time
+
+def box_iou(box_a, box_b):
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    top, bottom = max(box_a[0], box_b[0]), min(box_a[2], box_b[2])
+    left, right = max(box_a[3], box_b[3]), min(box_a[1], box_b[1])
+    intersection = max(0, bottom - top) * max(0, right - left)
+    area_a = (box_a[2] - box_a[0]) * (box_a[1] - box_a[3])
+    area_b = (box_b[2] - box_b[0]) * (box_b[1] - box_b[3])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+class Track:
+    """One face followed across frames, with the identity it was last recognized as."""
+
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = box
+        self.first_seen = now
+        self.last_seen = now
+        self.student_id = None # None until the track has been encoded and matched once
+        self.distance = None
+        self.verified_at = None
+
+class FaceTracker:
+    """Associates face boxes across frames by IoU so each person is encoded and reported once per appearance."""
+
+    def __init__(self, iou_threshold=0.3, lost_seconds=2.0, reverify_seconds=5.0, unknown_reverify_seconds=1.0):
+        self.iou_threshold = iou_threshold # Minimum overlap for a box to continue an existing track
+        self.lost_seconds = lost_seconds # Tracks not seen for this long are dropped (the next appearance is a new event)
+        self.reverify_seconds = reverify_seconds # Identified tracks are re-encoded this often to catch swaps
+        self.unknown_reverify_seconds = unknown_reverify_seconds # Unknown tracks are retried sooner (e.g. face turned away)
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, face_locations, now=None):
+        """Matches this frame's boxes to tracks (greedy, highest IoU first); returns the track for each box."""
+        now = time.monotonic() if now is None else now
+        self.tracks = [track for track in self.tracks if now - track.last_seen <= self.lost_seconds]
+
+        pairs = sorted(((box_iou(track.box, box), t, b) for t, track in enumerate(self.tracks) for b, box in enumerate(face_locations)), reverse=True)
+        assigned = [None] * len(face_locations)
+        used_tracks = set()
+        for iou, t, b in pairs:
+            if iou < self.iou_threshold:
+                break
+            if t in used_tracks or assigned[b] is not None:
+                continue
+            used_tracks.add(t)
+            assigned[b] = self.tracks[t]
+
+        for b, box in enumerate(face_locations):
+            track = assigned[b]
+            if track is None:
+                track = Track(next(self._ids), box, now)
+                self.tracks.append(track)
+                assigned[b] = track
+            track.box = box
+            track.last_seen = now
+        return assigned
+
+    def needs_identity(self, track, now=None):
+        """True if the track has never been matched or is due for re-verification."""
+        now = time.monotonic() if now is None else now
+        if track.student_id is None:
+            return True
+        interval = self.unknown_reverify_seconds if track.student_id == "Unknown" else self.reverify_seconds
+        return now - track.verified_at >= interval
+
+    def assign(self, track, student_id, distance, now=None):
+        """Records a match result for the track; returns True if it should produce an attendance/detected event."""
+        now = time.monotonic() if now is None else now
+        track.verified_at = now
+        if student_id == track.student_id:
+            track.distance = distance
+            return False
+        if student_id == "Unknown" and track.student_id is not None:
+            return False # A bad angle on re-verification does not undo a positive identification
+        track.student_id = student_id
+        track.distance = distance
+        return True
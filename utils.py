@@ -1,19 +1,4 @@
 import json
-import RPi.GPIO as GPIO
-from datetime import datetime
-import time
-import cv2
-import base64
-from RPLCD.i2c import CharLCD
-
-# LCD setup (initialize globally)
-try:
-    lcd = CharLCD('PCF8574', address=0x27, cols=20, rows=4) #20 columns and 4 rows.
-    lcd.clear()
-    lcd.write_string("StreakTrack is On")
-except Exception as e:
-    print(f"LCD initialization failed: {e}")
-    lcd = None
 
 def load_json(filepath):
     try:
@@ -26,33 +11,9 @@ def save_json(filepath, data):
     with open(filepath, "w") as f:
         json.dump(data, f)
 
-def blink_led(pin, duration):
-    GPIO.output(pin, GPIO.HIGH)
-    time.sleep(duration)
-    GPIO.output(pin, GPIO.LOW)
-
 def format_timestamp(timestamp):
     return timestamp.strftime("%Y-%m-%d %H:%M:%S")
 
-def lcd_display(message):
-    if lcd:
-        lcd.clear()
-        lines = wrap_text(message, 20) #20 characters per line
-        for i, line in enumerate(lines):
-            if i < 4:  # Display up to 4 lines
-                lcd.cursor_pos = (i, 0)
-                lcd.write_string(line)
-
-def lcd_welcome():
-    if lcd:
-        lcd.clear()
-        lcd.cursor_pos = (0, 0)
-        lcd.write_string("Welcome")
-        lcd.cursor_pos = (1, 3)  # Indent 'to' with spaces
-        lcd.write_string("to")
-        lcd.cursor_pos = (2, 0)
-        lcd.write_string("StreakTrack")
-
 def wrap_text(text, line_length):
     """Wraps text to fit within a given line length."""
     words = text.split()
@@ -0,0 +1,221 @@
+import asyncio
+import functools
+import json
+import random
+import time
+from collections import deque
+import websockets
+from websockets.exceptions import ConnectionClosed
+
+# Outbound priorities: lower numbers are always sent first
+PRIORITY_ATTENDANCE = 0
+PRIORITY_DETECTED = 1
+PRIORITY_STREAM = 2
+
+class ConnectionManager:
+    """Keeps the server websocket connected and owns the single task that sends on it."""
+
+    def __init__(self, uri, on_message=None, on_connect=None, on_disconnect=None, connect=None,
+                 min_backoff=1.0, max_backoff=60.0, heartbeat_interval=15.0, heartbeat_timeout=10.0,
+                 batch_max=50, queue_sizes=(1000, 200, 1), observe_latency=None):
+        self.uri = uri
+        self.on_message = on_message # async callback(data) for every JSON message received
+        self.on_connect = on_connect # async callback() after each (re)connect
+        self.on_disconnect = on_disconnect # async callback() after each lost or failed connection
+        # Our own heartbeat measures latency, so the library's keepalive pings are disabled
+        self.connect = connect or functools.partial(websockets.connect, ping_interval=None)
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.batch_max = batch_max # JSON messages coalesced into one batch frame
+        self.queue_sizes = queue_sizes # Per priority; producers wait when their queue is full, stream frames replace the oldest
+        self.observe_latency = observe_latency # Optional callback(seconds) for every websocket send
+        self.websocket = None
+        self.connected = asyncio.Event()
+        self.latency = None # Last heartbeat round-trip in seconds
+        self.reconnects = 0
+        self._established = False # Set once the current connection proved itself (a message or heartbeat got through)
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.last_send_latency = 0.0
+        self._queues = [deque() for _ in queue_sizes]
+        self._ready = asyncio.Event() # Set whenever any queue has something to send
+        self._space = [asyncio.Event() for _ in queue_sizes] # Set while the queue has room
+
+    def is_connected(self):
+        return self.connected.is_set()
+
+    def queue_depth(self, priority=None):
+        if priority is None:
+            return sum(len(queue) for queue in self._queues)
+        return len(self._queues[priority])
+
+    async def send(self, message, priority=PRIORITY_DETECTED):
+        """Queues a JSON-serializable message, waiting while its queue is full; returns a future set once it is sent."""
+        if priority == PRIORITY_STREAM:
+            return self.offer_frame(message)
+        queue = self._queues[priority]
+        while len(queue) >= self.queue_sizes[priority]:
+            self._space[priority].clear()
+            await self._space[priority].wait() # Backpressure: the producer waits for the sender to catch up
+        future = asyncio.get_running_loop().create_future()
+        queue.append((message, future))
+        self._ready.set()
+        return future
+
+    def offer(self, message, priority=PRIORITY_DETECTED):
+        """Queues a message without waiting, dropping the oldest queued one of that priority if full; returns its future."""
+        queue = self._queues[priority]
+        while len(queue) >= self.queue_sizes[priority]:
+            _, stale_future = queue.popleft()
+            stale_future.cancel()
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception()) # Callers may ignore the outcome; no "never retrieved" warning
+        queue.append((message, future))
+        self._ready.set()
+        return future
+
+    def offer_frame(self, payload):
+        """Queues a stream frame (bytes or str) without waiting, replacing the queued frame."""
+        return self.offer(payload, PRIORITY_STREAM)
+
+    def _next_frame(self):
+        """Takes the next websocket frame to send: coalesced JSON messages first, then one stream frame."""
+        batch = []
+        for priority in (PRIORITY_ATTENDANCE, PRIORITY_DETECTED):
+            queue = self._queues[priority]
+            while queue and len(batch) < self.batch_max:
+                batch.append(queue.popleft())
+            self._space[priority].set()
+        if batch:
+            messages = [message for message, _ in batch]
+            data = json.dumps(messages[0] if len(messages) == 1 else {"type": "batch", "messages": messages})
+            return data, [future for _, future in batch]
+        queue = self._queues[PRIORITY_STREAM]
+        if queue:
+            payload, future = queue.popleft()
+            return payload, [future]
+        return None, []
+
+    async def _send_loop(self):
+        """The only coroutine that writes to the websocket."""
+        while True:
+            await self.connected.wait()
+            data, futures = self._next_frame()
+            if data is None:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            websocket = self.websocket
+            started = time.monotonic()
+            try:
+                await websocket.send(data)
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(ConnectionError(f"Send failed: {e}"))
+                await self._close(websocket)
+                continue
+            self.last_send_latency = time.monotonic() - started
+            self.frames_sent += 1
+            self.bytes_sent += len(data)
+            if self.observe_latency:
+                self.observe_latency(self.last_send_latency)
+            for future in futures:
+                if not future.done():
+                    future.set_result(self.last_send_latency)
+
+    async def _heartbeat(self, websocket):
+        """Pings the server periodically to measure latency and detect dead connections."""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            started = time.monotonic()
+            try:
+                pong_waiter = await websocket.ping()
+                await asyncio.wait_for(pong_waiter, self.heartbeat_timeout)
+            except Exception:
+                print("Heartbeat lost, reconnecting.")
+                await self._close(websocket)
+                return
+            self.latency = time.monotonic() - started
+            self._established = True
+
+    async def _close(self, websocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+    def _fail_pending(self):
+        """Fails every queued message; durable data (the attendance outbox) is re-sent after reconnecting."""
+        for queue in self._queues:
+            while queue:
+                _, future = queue.popleft()
+                if not future.done():
+                    future.set_exception(ConnectionError("WebSocket connection closed."))
+        for space in self._space:
+            space.set()
+
+    async def run(self):
+        """Connects, dispatches received messages and reconnects with exponential backoff, forever."""
+        sender = asyncio.create_task(self._send_loop())
+        backoff = self.min_backoff
+        try:
+            while True:
+                try:
+                    websocket = await self.connect(self.uri)
+                except Exception as e:
+                    delay = backoff * random.uniform(0.5, 1.0) # Jitter so a room of devices does not reconnect in lockstep
+                    print(f"Error connecting to StreakTrack: {e}. Retrying in {delay:.1f}s.")
+                    if self.on_disconnect:
+                        await self.on_disconnect()
+                    await asyncio.sleep(delay)
+                    backoff = min(self.max_backoff, backoff * 2)
+                    continue
+
+                self._established = False
+                self.websocket = websocket
+                self.connected.set()
+                heartbeat = asyncio.create_task(self._heartbeat(websocket))
+                if self.on_connect:
+                    asyncio.create_task(self.on_connect())
+                try:
+                    async for message in websocket:
+                        await self._dispatch(message)
+                except ConnectionClosed:
+                    pass
+                finally:
+                    print("WebSocket connection closed.")
+                    self.connected.clear()
+                    self.websocket = None
+                    heartbeat.cancel()
+                    self._fail_pending()
+                    self.reconnects += 1
+                if self.on_disconnect:
+                    await self.on_disconnect()
+                # A server that accepts and then drops us must not cause a reconnect storm: the backoff only
+                # starts over after a connection that actually worked, and there is always a wait
+                if self._established:
+                    backoff = self.min_backoff
+                delay = backoff * random.uniform(0.5, 1.0)
+                print(f"Reconnecting in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+                backoff = min(self.max_backoff, backoff * 2)
+        finally:
+            sender.cancel()
+
+    async def _dispatch(self, message):
+        self._established = True
+        if isinstance(message, bytes):
+            return # The server only sends JSON text
+        try:
+            data = json.loads(message)
+        except json.JSONDecodeError:
+            print("Received invalid JSON message.")
+            return
+        if self.on_message:
+            try:
+                await self.on_message(data)
+            except Exception as e:
+                print(f"Error handling WebSocket message: {e}")